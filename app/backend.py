@@ -0,0 +1,200 @@
+# app/backend.py
+# 프런트엔드(server/rt_server)가 쓰는 추론 백엔드
+#   local  : 이 프로세스에 Explainer를 올리고 InferenceScheduler로 실행 (기존 방식)
+#   remote : 모델 호스트 프로세스(app.model_host)들에 유닉스 소켓으로 전달, 최소 부하 + 세션 고정 라우팅
+import asyncio, logging, threading, yaml
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from .preprocess import load_image
+from .scheduler import InferenceScheduler, PRIORITY_NORMAL
+from .metrics import StageTimer
+from .model_host import HostClient
+
+log = logging.getLogger(__name__)
+
+class NotReady(Exception):
+    # 모델 로딩/워밍업이 아직 끝나지 않음 (HTTP 503)
+    pass
+
+class LocalBackend:
+    def __init__(self, cfg_path: str = "config.yml"):
+        self.cfg_path = cfg_path
+        with open(cfg_path, "r", encoding="utf-8") as f:
+            self.cfg = yaml.safe_load(f)
+        self.pipe = None
+        self.sched: Optional[InferenceScheduler] = None
+        self.state = "idle"
+        self.error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def start(self):
+        # HTTP 서버는 바로 뜨고, 가중치 로드 + 워밍업은 백그라운드 스레드에서
+        if self.state == "idle":
+            self.state = "loading"
+            threading.Thread(target=self.load, name="model-load", daemon=True).start()
+
+    def load(self):
+        self.state = "loading"
+        try:
+            # torch는 여기서 처음 import (remote 모드 프런트엔드는 모델/torch 없이 뜸)
+            from .pipeline import Explainer
+            pipe = Explainer(cfg_path=self.cfg_path)
+            pipe.warmup()
+            self.sched = InferenceScheduler.from_cfg(self.cfg)
+            self.pipe = pipe
+            self.state = "ready"
+        except Exception as e:
+            log.exception("model load failed")
+            self.error = repr(e)
+            self.state = "failed"
+
+    def _check_ready(self):
+        if not self.ready:
+            raise NotReady(self.state)
+
+    async def preprocess(self, img_bytes: bytes, timer: Optional[StageTimer] = None) -> np.ndarray:
+        self._check_ready()
+        # 디코딩/리사이즈는 전용 풀에서 미리 (앞선 요청의 generate와 겹쳐서 진행)
+        return await asyncio.get_running_loop().run_in_executor(self.pipe.decode_pool, self.pipe.preprocess, img_bytes, timer)
+
+    async def explain(self, img: np.ndarray, query: str, priority: int = PRIORITY_NORMAL,
+                      deadline_ms: Optional[int] = None, session: Optional[str] = None,
+                      new_scene: bool = True) -> Dict[str, Any]:
+        self._check_ready()
+        if session is not None and self.pipe.sessions is not None and not new_scene:
+            # 후속 질문은 세션의 대화 kv를 이어 쓰므로 단독 실행
+            return await self.sched.submit(self.pipe.explain, img, query, session=session, new_scene=False,
+                                           priority=priority, deadline_ms=deadline_ms)
+        # 새 장면(세션 대화 시작 포함)은 다른 요청/세션과 묶어서 실행, 세션 kv는 배치에서 행별로 떼어 저장
+        return await self.sched.submit_batched(self.pipe.explain_batch, (img, query, session),
+                                               priority=priority, deadline_ms=deadline_ms)
+
+    def explain_stream(self, img: np.ndarray, query: str, priority: int = PRIORITY_NORMAL,
+                       deadline_ms: Optional[int] = None, session: Optional[str] = None,
+                       new_scene: bool = True) -> AsyncIterator[Tuple[str, Any]]:
+        # 큐가 가득 차면 여기서 바로 QueueFull
+        self._check_ready()
+        return self.sched.submit_stream(self.pipe.explain, img, query, session=session, new_scene=new_scene,
+                                        priority=priority, deadline_ms=deadline_ms)
+
+    async def release(self, session: str):
+        if self.ready:
+            self.pipe.release_session(session)
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.ready:
+            return {"state": self.state, "error": self.error}
+        return dict(self.sched.stats, queued=self.sched.qsize(), state=self.state)
+
+class HostRouter:
+    def __init__(self, sockets: List[str], max_side: int = 896, fast_filter_ratio: float = 2.0, workers: int = 4,
+                 connect_timeout_s: float = 5.0, retry_s: float = 5.0):
+        self.hosts = [HostClient(p, connect_timeout_s, retry_s) for p in sockets]
+        self.max_side = max_side
+        self.fast_filter_ratio = fast_filter_ratio
+        self.decode_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode")
+        # 세션(웹소켓 연결) → 호스트: 같은 세션은 같은 호스트로 (호스트 쪽 세션 상태 재사용)
+        self._sticky: Dict[str, HostClient] = {}
+        self.retry_s = retry_s
+        self._reconnect: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_cfg(cls, cfg: Dict[str, Any]) -> "HostRouter":
+        sv = (cfg.get("serving") or {})
+        pp = (cfg.get("preprocess") or {})
+        return cls(
+            sockets=[h["socket"] for h in (sv.get("hosts") or [])],
+            max_side=int(cfg.get("max_side", 896)),
+            fast_filter_ratio=float(pp.get("fast_filter_ratio", 2.0)),
+            workers=int(pp.get("workers", 4)),
+            connect_timeout_s=float(sv.get("connect_timeout_s", 5.0)),
+            retry_s=float(sv.get("retry_s", 5.0)),
+        )
+
+    @property
+    def ready(self) -> bool:
+        # 연결된 호스트가 하나라도 있으면 받음 (호스트는 로드/워밍업이 끝난 뒤에야 소켓을 엶)
+        return any(h.connected for h in self.hosts)
+
+    async def start(self):
+        if self._reconnect is None:
+            self._reconnect = asyncio.get_running_loop().create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self):
+        while True:
+            for h in self.hosts:
+                if not h.connected:
+                    try:
+                        await h.connect()
+                    except (OSError, asyncio.TimeoutError):
+                        pass
+            await asyncio.sleep(self.retry_s)
+
+    def _preprocess(self, img_bytes: bytes, timer: Optional[StageTimer]) -> np.ndarray:
+        t: Dict[str, float] = {}
+        img = load_image(img_bytes, self.max_side, self.fast_filter_ratio, timings=t)
+        if timer is not None:
+            for name, sec in t.items():
+                timer.add(name, sec)
+        return img
+
+    async def preprocess(self, img_bytes: bytes, timer: Optional[StageTimer] = None) -> np.ndarray:
+        # 디코딩은 프런트엔드에서 끝내고 호스트에는 RGB 배열만 넘김
+        return await asyncio.get_running_loop().run_in_executor(self.decode_pool, self._preprocess, img_bytes, timer)
+
+    async def _pick(self, session: Optional[str]) -> HostClient:
+        host = self._sticky.get(session) if session else None
+        if host is not None and host.up:
+            return host
+        # 살아 있는 호스트 중 부하가 가장 낮은 곳부터 연결 시도
+        for host in sorted((h for h in self.hosts if h.up), key=HostClient.score):
+            try:
+                await host.connect()
+            except (OSError, asyncio.TimeoutError):
+                continue
+            if session:
+                self._sticky[session] = host
+            return host
+        raise NotReady("no model host available")
+
+    async def explain(self, img: np.ndarray, query: str, priority: int = PRIORITY_NORMAL,
+                      deadline_ms: Optional[int] = None, session: Optional[str] = None,
+                      new_scene: bool = True) -> Dict[str, Any]:
+        host = await self._pick(session)
+        out = None
+        # 끝까지 돌아야 request()의 finally에서 공유 메모리가 바로 해제됨
+        async for msg in host.request("explain", img, query, priority=priority, deadline_ms=deadline_ms,
+                                      session=session, new_scene=new_scene):
+            out = msg["data"]
+        return out
+
+    async def explain_stream(self, img: np.ndarray, query: str, priority: int = PRIORITY_NORMAL,
+                             deadline_ms: Optional[int] = None, session: Optional[str] = None,
+                             new_scene: bool = True) -> AsyncIterator[Tuple[str, Any]]:
+        # 원격은 큐 상태를 미리 알 수 없으므로 QueueFull/DeadlineExceeded는 반복 중에 발생
+        host = await self._pick(session)
+        async for msg in host.request("stream", img, query, priority=priority, deadline_ms=deadline_ms,
+                                      session=session, new_scene=new_scene):
+            yield msg["type"], msg["data"]
+
+    async def release(self, session: str):
+        host = self._sticky.pop(session, None)
+        if host is not None:
+            await host.release(session)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hosts": [{"socket": h.path, "up": h.connected, "inflight": h.inflight, "load": h.load} for h in self.hosts],
+                "sessions": len(self._sticky)}
+
+def make_backend(cfg: Dict[str, Any], cfg_path: str = "config.yml"):
+    mode = str((cfg.get("serving") or {}).get("mode", "local")).lower()
+    if mode == "remote":
+        return HostRouter.from_cfg(cfg)
+    if mode != "local":
+        raise ValueError(f"unknown serving.mode {mode!r}")
+    return LocalBackend(cfg_path)
@@ -0,0 +1,73 @@
+# app/batch.py
+# 대량(오프라인) 추론 공용 도우미: 입력 목록 만들기(디렉터리/JSONL 매니페스트/zip), 결과 파일 이어쓰기
+import os, json, zipfile
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+MANIFEST_NAME = "manifest.jsonl"
+
+def is_image(name: str) -> bool:
+    return name.lower().endswith(IMAGE_EXTS) and not os.path.basename(name).startswith(".")
+
+def parse_manifest(lines: Iterable[str], query: str) -> List[Dict[str, Any]]:
+    # 한 줄 = {"image": 경로, "query"?: 질문, "id"?: 결과 키} (id가 없으면 image 경로)
+    items = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        obj = json.loads(line)
+        items.append({"id": str(obj.get("id") or obj["image"]), "image": obj["image"], "query": obj.get("query") or query})
+    return items
+
+def dir_items(root: str, query: str) -> List[Dict[str, Any]]:
+    # 정렬된 순서 = 출력 순서 (재시작해도 같은 순서)
+    items = []
+    for d, dirs, files in os.walk(root):
+        dirs.sort()
+        for f in sorted(files):
+            if is_image(f):
+                path = os.path.join(d, f)
+                items.append({"id": os.path.relpath(path, root), "image": path, "query": query})
+    return items
+
+def zip_items(zf: zipfile.ZipFile, query: str) -> List[Dict[str, Any]]:
+    # zip 안에 manifest.jsonl이 있으면 그 순서/질문, 없으면 이미지 파일 이름순
+    names = set(zf.namelist())
+    if MANIFEST_NAME in names:
+        return parse_manifest(zf.read(MANIFEST_NAME).decode("utf-8").splitlines(), query)
+    return [{"id": n, "image": n, "query": query} for n in sorted(names) if is_image(n)]
+
+def load_done(out_path: str) -> Set[str]:
+    # 결과 파일이 곧 체크포인트: 이미 결과가 기록된 id는 건너뜀
+    # 에러로 기록된 항목(OOM, busy 등 일시적 실패일 수 있음)은 다시 시도 → 같은 id는 마지막 줄이 최종 결과
+    # 중간에 죽어서 마지막 줄이 잘렸으면 그 줄은 잘라내고 이어씀
+    done: Set[str] = set()
+    if not os.path.exists(out_path):
+        return done
+    good = 0
+    with open(out_path, "rb") as f:
+        for raw in f:
+            try:
+                if not raw.endswith(b"\n"):
+                    raise ValueError("partial line")
+                rec = json.loads(raw)
+                if "error" in rec:
+                    done.discard(str(rec["id"]))
+                else:
+                    done.add(str(rec["id"]))
+            except (ValueError, KeyError):
+                break
+            good += len(raw)
+    if good != os.path.getsize(out_path):
+        with open(out_path, "r+b") as f:
+            f.truncate(good)
+    return done
+
+def result_line(item: Dict[str, Any], out: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> str:
+    rec: Dict[str, Any] = {"id": item["id"], "query": item["query"]}
+    if error is not None:
+        rec["error"] = error
+    else:
+        rec.update(out or {})
+    return json.dumps(rec, ensure_ascii=False) + "\n"
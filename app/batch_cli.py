@@ -0,0 +1,107 @@
+# app/batch_cli.py
+# 오프라인 대량 추론: 디렉터리 또는 JSONL 매니페스트 → 결과 JSONL (입력 순서대로, 중단 후 이어서 실행 가능)
+# 실행: python -m app.batch_cli photos/ --out results.jsonl
+#       python -m app.batch_cli manifest.jsonl --out results.jsonl --batch-size 8 --prefetch 4
+import argparse, logging, os, sys, time
+from collections import deque
+from typing import Any, Dict, List, Tuple
+
+from .batch import dir_items, parse_manifest, load_done, result_line
+
+log = logging.getLogger(__name__)
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("input", help="image directory or JSONL manifest")
+    ap.add_argument("--out", required=True, help="results JSONL (appended; ids with a result are skipped, errors retried)")
+    ap.add_argument("--config", default="config.yml")
+    ap.add_argument("--query", default="이게 뭐야?", help="question for items without their own")
+    ap.add_argument("--batch-size", type=int, default=0, help="items per generate call (default: batch.max_size)")
+    ap.add_argument("--prefetch", type=int, default=2, help="batches decoded ahead of the model")
+    ap.add_argument("--timings", action="store_true", help="keep per-stage timings in the output")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if os.path.isdir(args.input):
+        items = dir_items(args.input, args.query)
+    else:
+        # 매니페스트의 상대 경로는 매니페스트 파일 기준
+        with open(args.input, "r", encoding="utf-8") as f:
+            items = parse_manifest(f, args.query)
+        base = os.path.dirname(os.path.abspath(args.input))
+        for it in items:
+            it["image"] = os.path.join(base, it["image"])
+
+    done = load_done(args.out)
+    todo = [it for it in items if it["id"] not in done]
+    log.info("%d items, %d already in %s, %d to go", len(items), len(items) - len(todo), args.out, len(todo))
+    if not todo:
+        return
+
+    from .pipeline import Explainer
+    pipe = Explainer(cfg_path=args.config)
+    bsz = args.batch_size or pipe.batch.max_size
+
+    def decode(it: Dict[str, Any]):
+        # 파일 읽기 + 디코딩/리사이즈를 Explainer의 디코드 풀에서 (GPU가 앞 배치를 생성하는 동안)
+        return pipe.preprocess(read_file(it["image"]))
+
+    # 앞으로 처리할 항목의 디코딩을 prefetch 배치만큼 미리 걸어둠
+    ahead = max(1, args.prefetch) * bsz
+    pending = deque()
+    it_todo = iter(todo)
+    for it in it_todo:
+        pending.append((it, pipe.decode_pool.submit(decode, it)))
+        if len(pending) >= ahead:
+            break
+
+    t0 = time.perf_counter()
+    n_done = 0
+    with open(args.out, "a", encoding="utf-8") as out:
+        while pending:
+            batch: List[Tuple[Dict[str, Any], Any]] = []
+            lines: List[str] = []
+            while pending and len(batch) < bsz:
+                it, fut = pending.popleft()
+                nxt = next(it_todo, None)
+                if nxt is not None:
+                    pending.append((nxt, pipe.decode_pool.submit(decode, nxt)))
+                try:
+                    batch.append((it, fut.result()))
+                except Exception as e:
+                    # 못 읽는 파일은 결과에 에러로 남기고 계속
+                    batch.append((it, e))
+
+            ok = [i for i, (_, img) in enumerate(batch) if not isinstance(img, Exception)]
+            results: Dict[int, Any] = {i: img for i, (_, img) in enumerate(batch)}
+            if ok:
+                try:
+                    outs = pipe.explain_batch([(batch[i][1], batch[i][0]["query"]) for i in ok])
+                except Exception as e:
+                    log.exception("batch failed")
+                    outs = [e] * len(ok)
+                results.update(zip(ok, outs))
+
+            # 입력 순서대로 기록 + 배치마다 fsync (결과 파일 = 체크포인트)
+            for i, (it, _) in enumerate(batch):
+                res = results[i]
+                if isinstance(res, Exception):
+                    lines.append(result_line(it, error=repr(res)))
+                else:
+                    if not args.timings:
+                        res = {k: v for k, v in res.items() if k != "timings"}
+                    lines.append(result_line(it, res))
+            out.writelines(lines)
+            out.flush()
+            os.fsync(out.fileno())
+
+            n_done += len(batch)
+            dt = time.perf_counter() - t0
+            log.info("%d/%d  %.2f img/s", n_done, len(todo), n_done / dt if dt > 0 else 0.0)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+# app/frame_cache.py
+# 실시간 프레임 중복 제거: 프레임의 지각 해시(dHash) + 정규화된 질문을 키로 설명 결과를 재사용
+import io, re, time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from PIL import Image
+
+def dhash(img_bytes: bytes, hash_size: int = 8) -> int:
+    img = Image.open(io.BytesIO(img_bytes))
+    # JPEG은 축소 디코딩으로 바로 작은 크기만 풀어냄 (다른 포맷은 무시됨)
+    img.draft("L", (hash_size * 4, hash_size * 4))
+    img = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    px = img.tobytes()
+    w = hash_size + 1
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            bits = (bits << 1) | (px[row * w + col] > px[row * w + col + 1])
+    return bits
+
+def normalize_query(q: str) -> str:
+    q = re.sub(r"[\s\?\!\.,~]+", " ", (q or "").lower())
+    return q.strip()
+
+class FrameAnswerCache:
+    def __init__(self, max_entries: int = 256, ttl_s: float = 30.0, max_distance: int = 6, hash_size: int = 8):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self.max_distance = int(max_distance)
+        self.hash_size = int(hash_size)
+        self._items: "OrderedDict[Tuple[int, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_cfg(cls, cfg: Dict[str, Any]) -> Optional["FrameAnswerCache"]:
+        c = (cfg.get("frame_cache") or {})
+        if not c.get("enabled", True):
+            return None
+        return cls(
+            max_entries=int(c.get("max_entries", 256)),
+            ttl_s=float(c.get("ttl_s", 30.0)),
+            max_distance=int(c.get("max_distance", 6)),
+            hash_size=int(c.get("hash_size", 8)),
+        )
+
+    def hash(self, img_bytes: bytes) -> int:
+        return dhash(img_bytes, self.hash_size)
+
+    def get(self, phash: int, query: str) -> Optional[Dict[str, Any]]:
+        q = normalize_query(query)
+        now = time.monotonic()
+        found = None
+        # 최근 항목부터 훑으면서 만료된 항목은 정리
+        for key in reversed(list(self._items.keys())):
+            ts, value = self._items[key]
+            if now - ts > self.ttl_s:
+                del self._items[key]
+                continue
+            if found is None and key[1] == q and bin(key[0] ^ phash).count("1") <= self.max_distance:
+                found = key
+        if found is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(found)
+        self.hits += 1
+        return self._items[found][1]
+
+    def put(self, phash: int, query: str, value: Dict[str, Any]):
+        key = (phash, normalize_query(query))
+        self._items[key] = (time.monotonic(), value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size": len(self._items),
+        }
@@ -0,0 +1,156 @@
+# app/metrics.py
+# 의존성 없는 Prometheus 텍스트 포맷 지표 (히스토그램/카운터/게이지) + 요청 단위 단계별 타이머
+import bisect, threading, time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 초 단위: 1ms ~ 60s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(k, "")) for k in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_fmt_labels(self.labelnames, k)} {v}" for k, v in self._values.items()]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float], labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def _samples(self) -> List[str]:
+        try:
+            return [f"{self.name} {float(self.fn())}"]
+        except Exception:
+            return []
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[i] += 1
+            total[0] += value
+
+    def _samples(self) -> List[str]:
+        out = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                acc = 0
+                for b, c in zip(self.buckets, counts):
+                    acc += c
+                    le = 'le="%s"' % b
+                    out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {acc}")
+                acc += counts[-1]
+                le = 'le="+Inf"'
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {acc}")
+                out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {total[0]}")
+                out.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {acc}")
+        return out
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_add(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_add(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_add(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]) -> Gauge:
+        # 게이지는 렌더링 시점에 fn()을 읽음 (이미 있으면 함수만 교체)
+        g = self._get_or_add(Gauge(name, help, fn))
+        g.fn = fn
+        return g
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("explain_stage_seconds", "Time spent in each Explainer stage", ("stage",))
+DECODE_TPS = REGISTRY.histogram(
+    "explain_decode_tokens_per_second", "Decode throughput per generate call",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+BATCH_SIZE = REGISTRY.histogram("explain_batch_size", "Requests per generate call", buckets=(1, 2, 4, 8, 16, 32))
+GENERATED_TOKENS = REGISTRY.counter("explain_generated_tokens_total", "Tokens generated")
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("scheduler_queue_wait_seconds", "Time a job waited in the inference queue")
+REQUEST_SECONDS = REGISTRY.histogram("http_request_seconds", "End-to-end handler latency", ("path",))
+
+class StageTimer:
+    # 요청(배치) 하나의 단계별 소요시간(ms)을 모으고 explain_stage_seconds에도 기록
+    def __init__(self, sync: Optional[Callable[[], None]] = None):
+        self.ms: Dict[str, float] = {}
+        self._sync = sync
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self._sync is not None:
+                # CUDA는 비동기라 동기화 없이는 다음 단계로 시간이 넘어감
+                self._sync()
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, name: str, seconds: float):
+        self.ms[name] = round(self.ms.get(name, 0.0) + seconds * 1000.0, 2)
+        STAGE_SECONDS.observe(seconds, stage=name)
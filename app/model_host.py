@@ -0,0 +1,276 @@
+# app/model_host.py
+# 모델 호스트 프로세스: Explainer + InferenceScheduler 하나를 유닉스 소켓으로 서비스
+# 프런트엔드(server/rt_server)는 이미지를 공유 메모리에 올리고 이름/shape만 소켓으로 보냄
+# 실행: python -m app.model_host 0   (config.yml serving.hosts[0]의 socket/device/cpus 사용)
+import os, sys, json, struct, asyncio, itertools, logging, time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+
+from .scheduler import QueueFull, DeadlineExceeded, PRIORITY_NORMAL
+
+log = logging.getLogger(__name__)
+
+# 메시지 = 길이(uint32, big-endian) + JSON
+MSG_HEADER = struct.Struct(">I")
+
+async def send_msg(writer: asyncio.StreamWriter, msg: Dict[str, Any]):
+    data = json.dumps(msg, ensure_ascii=False).encode("utf-8")
+    writer.write(MSG_HEADER.pack(len(data)) + data)
+    await writer.drain()
+
+async def recv_msg(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    try:
+        (n,) = MSG_HEADER.unpack(await reader.readexactly(MSG_HEADER.size))
+        return json.loads(await reader.readexactly(n))
+    except asyncio.IncompleteReadError:
+        return None
+
+def put_image(img: np.ndarray) -> shared_memory.SharedMemory:
+    # 만든 쪽(프런트엔드)이 응답을 받은 뒤 close/unlink
+    shm = shared_memory.SharedMemory(create=True, size=max(1, img.nbytes))
+    np.ndarray(img.shape, dtype=np.uint8, buffer=shm.buf)[...] = img
+    return shm
+
+def take_image(name: str, shape) -> np.ndarray:
+    # 호스트는 받자마자 복사하고 떼어냄 (unlink는 만든 쪽 책임이므로 resource_tracker에서 제외)
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+    try:
+        return np.ndarray(tuple(shape), dtype=np.uint8, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+
+class HostClient:
+    # 호스트 하나와의 연결 (요청 id로 다중화, 응답은 요청별 큐로 분배)
+    def __init__(self, path: str, connect_timeout_s: float = 5.0, retry_s: float = 5.0):
+        self.path = path
+        self.connect_timeout_s = connect_timeout_s
+        self.retry_s = retry_s
+        self.inflight = 0
+        # 호스트가 응답마다 알려주는 대기+실행 중 작업 수 (다른 프런트엔드 몫 포함)
+        self.load = 0
+        self.down_until = 0.0
+        self._ids = itertools.count()
+        self._waiters: Dict[int, asyncio.Queue] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    @property
+    def up(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def score(self) -> int:
+        return max(self.inflight, self.load)
+
+    async def connect(self):
+        async with self._lock:
+            await self._connect()
+
+    async def release(self, session: str):
+        # 세션이 끝났음을 알림 (호스트 쪽 세션 상태 정리 + 그 세션의 남은 요청 취소)
+        await self._notify({"op": "release", "session": session})
+
+    async def _notify(self, msg: Dict[str, Any]):
+        # 응답 없는 제어 메시지
+        if self._writer is None:
+            return
+        async with self._lock:
+            try:
+                await send_msg(self._writer, msg)
+            except (OSError, AttributeError):
+                pass
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        if self._writer is None:
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.path), self.connect_timeout_s)
+            except (OSError, asyncio.TimeoutError):
+                self.down_until = time.monotonic() + self.retry_s
+                raise
+            self._writer = writer
+            asyncio.get_running_loop().create_task(self._read_loop(reader, writer))
+        return self._writer
+
+    async def _read_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                msg = await recv_msg(reader)
+                if msg is None:
+                    break
+                self.load = int(msg.get("load", self.load))
+                q = self._waiters.get(msg.get("id"))
+                if q is not None:
+                    q.put_nowait(msg)
+        except (OSError, ValueError):
+            pass
+        finally:
+            # 호스트가 죽으면 걸려 있던 요청은 모두 실패 처리하고 잠시 라우팅에서 제외
+            if self._writer is writer:
+                self._writer = None
+                self.down_until = time.monotonic() + self.retry_s
+            for q in list(self._waiters.values()):
+                q.put_nowait({"type": "error", "error": "host disconnected"})
+            writer.close()
+
+    async def request(self, op: str, img: np.ndarray, query: str, **fields) -> AsyncIterator[Dict[str, Any]]:
+        shm = put_image(img)
+        rid = next(self._ids)
+        q: asyncio.Queue = asyncio.Queue()
+        self._waiters[rid] = q
+        self.inflight += 1
+        finished = False
+        try:
+            async with self._lock:
+                writer = await self._connect()
+                await send_msg(writer, {"id": rid, "op": op, "shm": shm.name, "shape": list(img.shape),
+                                        "query": query, **fields})
+            while True:
+                msg = await q.get()
+                finished = msg["type"] in ("error", "result")
+                if msg["type"] == "error":
+                    err = msg.get("error")
+                    if err == "busy":
+                        raise QueueFull("model host is busy")
+                    if err == "timeout":
+                        raise DeadlineExceeded("deadline exceeded on model host")
+                    raise RuntimeError(f"model host {self.path}: {err}")
+                yield msg
+                if msg["type"] == "result":
+                    break
+        finally:
+            self._waiters.pop(rid, None)
+            self.inflight -= 1
+            shm.close()
+            shm.unlink()
+            if not finished:
+                # 응답 전에 호출 쪽이 떠남(웹소켓 종료, SSE 끊김): 호스트에서 대기/실행 중인 작업도 취소
+                await self._notify({"op": "cancel", "id": rid})
+
+def parse_cpus(spec: Any) -> Set[int]:
+    # "0-7,16-23" | [0, 1, 2] | 4
+    if spec is None or spec == "":
+        return set()
+    if isinstance(spec, int):
+        return {spec}
+    if isinstance(spec, (list, tuple)):
+        return {int(c) for c in spec}
+    cpus: Set[int] = set()
+    for part in str(spec).split(","):
+        lo, _, hi = part.strip().partition("-")
+        cpus.update(range(int(lo), int(hi or lo) + 1))
+    return cpus
+
+def pin(spec: Dict[str, Any]):
+    # torch를 import하기 전에 불러야 함 (CUDA_VISIBLE_DEVICES, 스레드 수)
+    device = str(spec.get("device") or "")
+    if device.startswith("cuda:"):
+        os.environ["CUDA_VISIBLE_DEVICES"] = device.split(":", 1)[1]
+    elif device == "cpu":
+        os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    cpus = parse_cpus(spec.get("cpus"))
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+        os.environ.setdefault("OMP_NUM_THREADS", str(len(cpus)))
+
+async def serve(backend, path: str):
+    def load() -> int:
+        return backend.sched.qsize() + backend.sched.stats["running"]
+
+    async def handle_request(msg: Dict[str, Any], reply):
+        rid = msg.get("id")
+        try:
+            img = take_image(msg["shm"], msg["shape"])
+            opts = dict(priority=int(msg.get("priority", PRIORITY_NORMAL)), deadline_ms=msg.get("deadline_ms"),
+                        session=msg.get("session"), new_scene=bool(msg.get("new_scene", True)))
+            if msg.get("op") == "stream":
+                async for kind, value in backend.explain_stream(img, msg.get("query", ""), **opts):
+                    await reply({"id": rid, "type": kind, "data": value, "load": load()})
+            else:
+                out = await backend.explain(img, msg.get("query", ""), **opts)
+                await reply({"id": rid, "type": "result", "data": out, "load": load()})
+        except QueueFull:
+            await reply({"id": rid, "type": "error", "error": "busy", "load": load()})
+        except DeadlineExceeded:
+            await reply({"id": rid, "type": "error", "error": "timeout", "load": load()})
+        except ConnectionError:
+            # 프런트엔드가 끊김: 돌려줄 곳이 없음
+            return
+        except Exception as e:
+            log.exception("request %s failed", rid)
+            await reply({"id": rid, "type": "error", "error": repr(e), "load": load()})
+
+    async def handle_conn(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        lock = asyncio.Lock()
+        # 요청 id → (작업, 세션 id)
+        tasks: Dict[Any, Tuple[asyncio.Task, Optional[str]]] = {}
+
+        async def reply(msg: Dict[str, Any]):
+            async with lock:
+                await send_msg(writer, msg)
+
+        try:
+            while True:
+                msg = await recv_msg(reader)
+                if msg is None:
+                    break
+                op = msg.get("op")
+                if op == "cancel":
+                    t, _ = tasks.get(msg.get("id"), (None, None))
+                    if t is not None:
+                        t.cancel()
+                    continue
+                if op == "release":
+                    # 아직 큐에 있는 그 세션의 요청은 실행되면 세션을 다시 만들므로 같이 취소
+                    session = msg.get("session")
+                    for t, owner in list(tasks.values()):
+                        if owner == session:
+                            t.cancel()
+                    await backend.release(session)
+                    continue
+                rid = msg.get("id")
+                t = asyncio.create_task(handle_request(msg, reply))
+                tasks[rid] = (t, msg.get("session"))
+                t.add_done_callback(lambda _, rid=rid: tasks.pop(rid, None))
+        finally:
+            for t, _ in list(tasks.values()):
+                t.cancel()
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(handle_conn, path=path)
+    log.info("model host listening on %s", path)
+    async with server:
+        await server.serve_forever()
+
+def main():
+    import yaml
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    cfg_path = os.environ.get("EXPLAINER_CONFIG", "config.yml")
+    with open(cfg_path, "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    hosts = (cfg.get("serving") or {}).get("hosts") or []
+    idx = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    if idx >= len(hosts):
+        sys.exit(f"serving.hosts[{idx}] is not configured")
+    spec = hosts[idx]
+    pin(spec)
+
+    # torch/모델은 고정(pin) 이후에 로드, 소켓은 로드/워밍업이 끝난 뒤에 열어 라우터가 준비된 호스트만 보게 함
+    from .backend import LocalBackend
+    backend = LocalBackend(cfg_path)
+    backend.load()
+    if not backend.ready:
+        sys.exit(f"model load failed: {backend.error}")
+    asyncio.run(serve(backend, spec["socket"]))
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,36 @@
 # app/pipeline.py
-import io, yaml, torch, re
-from PIL import Image
-from dataclasses import dataclass
-from typing import Dict, Any, Optional
+import re, os, time, yaml, torch, copy, hashlib, logging, threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, List, Set, Tuple, Callable, Union
 
-from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
+from transformers import (
+    AutoProcessor, Qwen2VLForConditionalGeneration, DynamicCache,
+    LogitsProcessorList, RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper, TextStreamer,
+    StoppingCriteria, StoppingCriteriaList,
+)
 from .prompts import SYSTEM_PROMPT, USER_TEMPLATE
+from .preprocess import load_image
+from .metrics import REGISTRY, StageTimer, DECODE_TPS, BATCH_SIZE, GENERATED_TOKENS
+
+log = logging.getLogger(__name__)
+
+DTYPES = {"fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+def _rss_mb() -> float:
+    # 이 프로세스의 RSS (/proc로 읽어 psutil 의존성 없이)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+# 이미지 입력: 인코딩된 바이트 또는 Explainer.preprocess로 이미 디코딩/리사이즈된 RGB 배열
+ImageInput = Union[bytes, np.ndarray]
 
 @dataclass
 class GenCfg:
@@ -15,6 +40,241 @@ class GenCfg:
     top_p: float = 1.0
     top_k: int = 50
 
+@dataclass
+class BatchCfg:
+    max_size: int = 4
+    max_wait_ms: int = 10
+
+# 종결 부호 뒤에 공백이 와야 문장 끝으로 봄 ("8.5", "Gen 2.0"은 문장 끝이 아님)
+SENTENCE_END = re.compile(r"[.!?。！？…]+[\"'”’)\]]*(?=\s)")
+# 모델이 채팅 템플릿이나 시스템 프롬프트의 예시(Q:/A:)를 따라 쓰기 시작한 경우
+ROLE_MARKER = re.compile(r"<\|im_(?:start|end)\|>|(?:^|\n)\s*(?:system|user|assistant|User|Assistant|Q|A)\s*[:：\n]")
+# 답변 맨 앞의 역할 표시 ("A: ...", "assistant\n...")는 종료가 아니라 떼어낼 접두어
+ROLE_PREFIX = re.compile(r"\s*(?:<\|im_start\|>)?\s*(?:system|user|assistant|User|Assistant|Q|A)\s*[:：\n]\s*")
+EXACT_MODEL_QUERY = re.compile(
+    r"모델\s*(?:명|이름|번호)|정확한|정확히|몇\s*년|출시|exact|model\s*(?:name|number)|which\s+model|what\s+model",
+    re.IGNORECASE,
+)
+
+@dataclass
+class StopCfg:
+    sentence: bool = True
+    role_markers: bool = True
+    # 질문 유형 → (max_new_tokens, 문장 수); 정확한 모델명 질문은 사양 설명용으로 몇 문장 더 허용
+    budgets: Dict[str, Tuple[int, int]] = field(default_factory=lambda: {"default": (64, 1), "exact_model": (160, 3)})
+
+def classify_query(user_query: str) -> str:
+    return "exact_model" if EXACT_MODEL_QUERY.search(user_query or "") else "default"
+
+def answer_span(text: str) -> Tuple[int, Optional[int]]:
+    # (답변 시작, 따라 쓴 역할 표식 위치 또는 None)
+    # 앞의 역할 접두어는 건너뛰고, 표식 앞에 답변 텍스트가 있어야 따라 쓰기로 봄
+    start = 0
+    m = ROLE_PREFIX.match(text)
+    while m is not None and m.end() > start:
+        start = m.end()
+        m = ROLE_PREFIX.match(text, start)
+    for m in ROLE_MARKER.finditer(text, start):
+        if text[start:m.start()].strip():
+            return start, m.start()
+    return start, None
+
+class StopPolicies(StoppingCriteria):
+    # generate()와 캐시 디코드 루프가 같이 쓰는 행별 조기 종료 (어떤 정책으로 멈췄는지 기록)
+    def __init__(self, tokenizer, eos_ids: torch.Tensor, query_types: List[str], cfg: StopCfg,
+                 max_new_tokens: int, prompt_len: int = 0):
+        self.tokenizer = tokenizer
+        self.eos_ids = eos_ids
+        self.cfg = cfg
+        self.prompt_len = prompt_len
+        default = cfg.budgets.get("default", (max_new_tokens, 1))
+        budgets = [cfg.budgets.get(t, default) for t in query_types]
+        self.max_tokens = [min(int(n), max_new_tokens) for n, _ in budgets]
+        self.max_sentences = [max(1, int(k)) for _, k in budgets]
+        self.max_steps = max(self.max_tokens)
+        self.reasons: List[Optional[str]] = [None] * len(query_types)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        new = input_ids[:, self.prompt_len:]
+        for i, reason in enumerate(self.reasons):
+            if reason is None:
+                self.reasons[i] = self._check(i, new[i])
+        return torch.tensor([r is not None for r in self.reasons], dtype=torch.bool, device=input_ids.device)
+
+    def _check(self, i: int, row: torch.Tensor) -> Optional[str]:
+        if row.numel() and bool(torch.isin(row[-1], self.eos_ids)):
+            return "eos"
+        if self.cfg.sentence or self.cfg.role_markers:
+            text = self.tokenizer.decode(row, skip_special_tokens=False)
+            if self.cfg.role_markers:
+                start, end = answer_span(text)
+                if end is not None:
+                    return "role_marker"
+                text = text[start:]
+            if self.cfg.sentence and len(SENTENCE_END.findall(text)) >= self.max_sentences[i]:
+                return "sentence"
+        if row.numel() >= self.max_tokens[i]:
+            return "budget"
+        return None
+
+    def reason(self, i: int) -> str:
+        return self.reasons[i] or "max_new_tokens"
+
+    def trim(self, i: int, text: str) -> str:
+        # 정책이 멈춘 지점 뒤에 디코딩된 부분 제거 (종결 부호 다음 토큰, 따라 쓴 역할 턴)와 앞의 역할 접두어 제거
+        if self.cfg.role_markers:
+            start, end = answer_span(text)
+            text = text[start:end]
+        if self.reasons[i] == "sentence":
+            ends = list(SENTENCE_END.finditer(text))
+            if len(ends) >= self.max_sentences[i]:
+                text = text[:ends[self.max_sentences[i] - 1].end()]
+        return text
+
+class VisionCache:
+    # 비전 타워 출력(이미지 임베딩 + grid_thw) LRU: 키는 전처리된 픽셀의 해시, 임베딩 텐서 바이트 합으로 상한
+    def __init__(self, max_bytes: int):
+        self.max_bytes = int(max_bytes)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[str, Tuple[torch.Tensor, torch.Tensor]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(img: np.ndarray) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(str(img.shape).encode())
+        h.update(memoryview(np.ascontiguousarray(img)).cast("B"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return hit
+
+    def put(self, key: str, embeds: torch.Tensor, grid_thw: torch.Tensor):
+        size = embeds.numel() * embeds.element_size()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= old[0].numel() * old[0].element_size()
+            self._items[key] = (embeds, grid_thw)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (e, _) = self._items.popitem(last=False)
+                self.bytes -= e.numel() * e.element_size()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._items), "bytes": self.bytes}
+
+def _kv_layers(kv: DynamicCache) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    layers = getattr(kv, "layers", None)
+    if layers is not None:
+        return [(layer.keys, layer.values) for layer in layers if layer.keys is not None]
+    return list(zip(kv.key_cache, kv.value_cache))
+
+def _kv_bytes(kv: DynamicCache) -> int:
+    return sum(t.numel() * t.element_size() for layer in _kv_layers(kv) for t in layer)
+
+def _kv_row(kv: DynamicCache, i: int, length: int) -> DynamicCache:
+    # 배치 kv에서 i번째 행의 앞 length개 위치만 떼어냄 (배치 텐서를 붙잡지 않도록 복사)
+    layers = _kv_layers(kv)
+    k0 = layers[0][0]
+    if k0.shape[0] == 1 and k0.shape[2] == length:
+        return kv
+    row = DynamicCache()
+    for idx, (k, v) in enumerate(layers):
+        row.update(k[i:i + 1, :, :length].clone(), v[i:i + 1, :, :length].clone(), idx)
+    return row
+
+@dataclass
+class SessionState:
+    kv: DynamicCache
+    mask: torch.Tensor  # (1, kv 길이) 어텐션 마스크 (배치로 시작한 대화는 prefix와 suffix 사이에 패딩이 있음)
+    ids: torch.Tensor   # (1, L) 지금까지의 대화 전체 토큰 (repetition penalty용)
+    tail: torch.Tensor  # (1, 1) 마지막 생성 토큰 (아직 kv에 없음)
+    tail_pos: int       # 그 토큰의 M-RoPE 위치
+    turn: int
+    bytes: int
+
+class SessionStore:
+    # 세션별 대화 kv LRU: 세션 상한을 넘으면 저장하지 않고, 전체 예산을 넘으면 오래 안 쓴 세션부터 제거
+    # 턴 하나 = take() → 생성 → put(): 그 사이에 drop()된 세션은 put()에서 다시 만들지 않음
+    def __init__(self, max_session_bytes: int, max_total_bytes: int):
+        self.max_session_bytes = int(max_session_bytes)
+        self.max_total_bytes = int(max_total_bytes)
+        self.bytes = 0
+        self.evictions = 0
+        self._items: "OrderedDict[str, SessionState]" = OrderedDict()
+        self._busy: Dict[str, int] = {}
+        self._released: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _pop_locked(self, session: str) -> Optional[SessionState]:
+        state = self._items.pop(session, None)
+        if state is not None:
+            self.bytes -= state.bytes
+        return state
+
+    def take(self, session: str) -> Optional[SessionState]:
+        # 턴 시작: 상태를 꺼내고 진행 중으로 표시 (실패한 턴이 반쯤 늘어난 kv를 남기지 않도록)
+        with self._lock:
+            self._busy[session] = self._busy.get(session, 0) + 1
+            return self._pop_locked(session)
+
+    def drop(self, session: str):
+        # 세션 종료: 진행 중인 턴이 있으면 그 턴이 끝날 때 저장하지 않도록 표시
+        with self._lock:
+            self._pop_locked(session)
+            if session in self._busy:
+                self._released.add(session)
+
+    def put(self, session: str, state: Optional[SessionState]):
+        # 턴 끝 (실패했으면 state=None)
+        with self._lock:
+            left = self._busy.get(session, 1) - 1
+            if left > 0:
+                self._busy[session] = left
+            else:
+                self._busy.pop(session, None)
+            if session in self._released:
+                if left <= 0:
+                    self._released.discard(session)
+                return
+            if state is None or state.bytes > self.max_session_bytes:
+                return
+            self._pop_locked(session)
+            self._items[session] = state
+            self.bytes += state.bytes
+            while self.bytes > self.max_total_bytes and len(self._items) > 1:
+                _, victim = self._items.popitem(last=False)
+                self.bytes -= victim.bytes
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sessions": len(self._items), "bytes": self.bytes, "evictions": self.evictions}
+
+class DeltaStreamer(TextStreamer):
+    # 새로 생성된 텍스트 조각을 stdout 대신 콜백으로 전달
+    def __init__(self, tokenizer, on_delta: Callable[[str], None], skip_prompt: bool = True):
+        super().__init__(tokenizer, skip_prompt=skip_prompt, skip_special_tokens=True)
+        self.on_delta = on_delta
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self.on_delta(text)
+
 class Explainer:
     def __init__(self, cfg_path: str = "config.yml"):
         with open(cfg_path, "r", encoding="utf-8") as f:
@@ -29,6 +289,10 @@ class Explainer:
             self.device = "cuda" if torch.cuda.is_available() else "cpu"
 
         self.max_side = int(self.cfg.get("max_side", 896))
+        pp = (self.cfg.get("preprocess") or {})
+        self.fast_filter_ratio = float(pp.get("fast_filter_ratio", 2.0))
+        # 디코딩은 전용 풀에서 (GPU가 생성하는 동안 서버가 다음 요청을 디코딩)
+        self.decode_pool = ThreadPoolExecutor(max_workers=int(pp.get("workers", 4)), thread_name_prefix="decode")
         self.model_id = self.cfg.get("qwen_model", "Qwen/Qwen2-VL-7B-Instruct")
 
         g = (self.cfg.get("gen") or {})
@@ -40,16 +304,37 @@ class Explainer:
             top_k=int(g.get("top_k", 50)),
         )
 
-        dtype = torch.float16 if (self.device == "cuda") else torch.float32
-        self.processor = AutoProcessor.from_pretrained(self.model_id, trust_remote_code=True)
-        self.model = Qwen2VLForConditionalGeneration.from_pretrained(
-            self.model_id,
-            torch_dtype=dtype,
-            device_map="auto",
-            trust_remote_code=True,
-            low_cpu_mem_usage=True,
+        st = (self.cfg.get("stop") or {})
+        self.stop = StopCfg(sentence=bool(st.get("sentence", True)), role_markers=bool(st.get("role_markers", True)))
+        if st.get("budgets"):
+            self.stop.budgets = {
+                k: (int(v.get("max_new_tokens", self.gen.max_new_tokens)), int(v.get("sentences", 1)))
+                for k, v in st["budgets"].items()
+            }
+
+        b = (self.cfg.get("batch") or {})
+        self.batch = BatchCfg(
+            max_size=max(1, int(b.get("max_size", 4))),
+            max_wait_ms=int(b.get("max_wait_ms", 10)),
         )
 
+        # 장치별 정밀도 (CPU 노드는 설정 시 더 작은 모델로 대체 가능)
+        pr = (self.cfg.get("precision") or {})
+        if self.device == "cuda":
+            self.precision = str(pr.get("cuda", "fp16")).lower()
+        else:
+            self.precision = str(pr.get("cpu", "fp32")).lower()
+            self.model_id = pr.get("cpu_model") or self.model_id
+        if self.precision not in DTYPES and not (self.precision == "int8" and self.device == "cpu"):
+            raise ValueError(f"unsupported precision {self.precision!r} on {self.device}")
+
+        t0 = time.perf_counter()
+        self.processor = AutoProcessor.from_pretrained(self.model_id, trust_remote_code=True)
+        # 배치 generate는 왼쪽 패딩이어야 모든 프롬프트가 새 토큰 바로 앞에서 끝남
+        self.processor.tokenizer.padding_side = "left"
+        self.model = self._load_model()
+        load_s = time.perf_counter() - t0
+
         if self.gen.do_sample:
             self.model.generation_config.update(
                 do_sample=True,
@@ -62,17 +347,168 @@ class Explainer:
                 do_sample=False
             )
 
-    def _resize(self, img: Image.Image) -> Image.Image:
-        w, h = img.size
-        scale = self.max_side / max(w, h)
-        if scale < 1.0:
-            img = img.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.LANCZOS)
+        # 시스템 프롬프트 prefix KV 캐시: 시스템 턴은 한 번만 prefill하고 모든 요청이 재사용
+        pc = (self.cfg.get("prefix_cache") or {})
+        self.prefix_cache_enabled = bool(pc.get("enabled", True))
+        self.prefix_cache_size = max(1, int(pc.get("max_entries", 4)))
+        self._prefix_cache: "OrderedDict[str, Tuple[torch.Tensor, DynamicCache]]" = OrderedDict()
+
+        # 비전 인코더 캐시: 같은 픽셀에 대한 반복 질문은 ViT와 이미지 프로세서를 건너뜀
+        vc = (self.cfg.get("vision_cache") or {})
+        self.vision_cache = VisionCache(int(float(vc.get("max_mb", 512)) * 1024 * 1024)) if vc.get("enabled", True) else None
+        if self.vision_cache is not None:
+            REGISTRY.gauge("vision_cache_hits", "Vision-encoder cache hits", lambda: self.vision_cache.hits)
+            REGISTRY.gauge("vision_cache_misses", "Vision-encoder cache misses", lambda: self.vision_cache.misses)
+            REGISTRY.gauge("vision_cache_bytes", "Bytes held by cached image embeddings", lambda: self.vision_cache.bytes)
+
+        # 세션별 대화 kv (실시간 후속 질문용), 세션당/전체 상한
+        sc = (self.cfg.get("session_cache") or {})
+        self.sessions = SessionStore(
+            max_session_bytes=int(float(sc.get("max_session_mb", 256)) * 1024 * 1024),
+            max_total_bytes=int(float(sc.get("max_total_mb", 2048)) * 1024 * 1024),
+        ) if sc.get("enabled", True) else None
+        if self.sessions is not None:
+            REGISTRY.gauge("session_cache_sessions", "Sessions holding a conversation kv", lambda: len(self.sessions))
+            REGISTRY.gauge("session_cache_bytes", "Bytes held by session kv caches", lambda: self.sessions.bytes)
+            REGISTRY.gauge("session_cache_evictions", "Session kv caches evicted by the memory budget",
+                           lambda: self.sessions.evictions)
+
+        inner = getattr(self.model, "model", self.model)
+        self._embed = self.model.get_input_embeddings()
+        self._visual = getattr(self.model, "visual", None) or inner.visual
+        self._rope_index = getattr(self.model, "get_rope_index", None) or inner.get_rope_index
+        self._logits_processor = self._build_logits_processor()
+
+        eos = self.model.generation_config.eos_token_id
+        eos = eos if isinstance(eos, (list, tuple)) else [eos]
+        self._eos_ids = torch.tensor([e for e in eos if e is not None], device=self.model.device)
+        self._pad_id = self.processor.tokenizer.pad_token_id
+        self._im_end_id = self.processor.tokenizer.convert_tokens_to_ids("<|im_end|>")
+        if self._pad_id is None:
+            self._pad_id = int(self._eos_ids[0])
+
+        if self.prefix_cache_enabled:
+            self._get_prefix(SYSTEM_PROMPT)
+
+        probe = int(pr.get("probe_tokens", 16))
+        log.info("loaded %s on %s precision=%s in %.1fs, rss=%.0f MB%s", self.model_id, self.device, self.precision,
+                 load_s, _rss_mb(), f", decode={self._probe_tps(probe):.1f} tok/s" if probe > 0 else "")
+
+    def _load_model(self):
+        if self.device == "cpu":
+            # CPU에서는 accelerate의 device_map이 필요 없고 아래 모듈 교체(양자화)에 방해가 됨
+            model = Qwen2VLForConditionalGeneration.from_pretrained(
+                self.model_id,
+                torch_dtype=torch.float32 if self.precision == "int8" else DTYPES[self.precision],
+                trust_remote_code=True,
+                low_cpu_mem_usage=True,
+                use_safetensors=True,
+            )
+            if self.precision == "int8":
+                # Linear 동적 int8: 가중치는 한 번, 활성값은 호출마다 양자화 (fp32 대비 메모리 약 1/4)
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            return model.eval()
+        return Qwen2VLForConditionalGeneration.from_pretrained(
+            self.model_id,
+            torch_dtype=DTYPES[self.precision],
+            device_map="auto",
+            trust_remote_code=True,
+            low_cpu_mem_usage=True,
+            # safetensors 샤드는 unpickle 대신 메모리 매핑 (로드 시간 단축의 대부분)
+            use_safetensors=True,
+        )
+
+    def _probe_tps(self, n_tokens: int) -> float:
+        # 짧은 텍스트 전용 greedy 디코드: 정밀도 모드별 처리량을 시작 시 같은 조건으로 기록
+        ids = self.processor.tokenizer(["Describe this object."], return_tensors="pt").input_ids.to(self.model.device)
+        with torch.inference_mode():
+            t0 = time.perf_counter()
+            out = self.model.generate(input_ids=ids, attention_mask=torch.ones_like(ids), do_sample=False,
+                                      max_new_tokens=n_tokens, min_new_tokens=n_tokens)
+            if self.device == "cuda":
+                torch.cuda.synchronize()
+        return (out.shape[1] - ids.shape[1]) / max(time.perf_counter() - t0, 1e-9)
+
+    def warmup(self) -> float:
+        # 설정된 배치 크기마다 explain을 한 번씩: 첫 실제 요청 전에 커널, 할당자 풀, vision cache 양쪽 경로를 데움
+        # 반환값은 걸린 시간(초)
+        w = (self.cfg.get("warmup") or {})
+        if not w.get("enabled", True):
+            return 0.0
+        size = int(w.get("image_size", 448))
+        yy, xx = np.mgrid[0:size, 0:size]
+        img = np.stack([xx * 255 // size, yy * 255 // size, (xx + yy) % 256], axis=-1).astype(np.uint8)
+        t0 = time.perf_counter()
+        for _ in range(max(1, int(w.get("runs", 2)))):
+            for bsz in w.get("batch_sizes") or [1]:
+                self.explain_batch([(img, w.get("query", "이게 뭐야?"))] * int(bsz))
+        sec = time.perf_counter() - t0
+        log.info("warmup done in %.1fs", sec)
+        return sec
+
+    def _build_logits_processor(self) -> LogitsProcessorList:
+        procs = LogitsProcessorList()
+        penalty = getattr(self.model.generation_config, "repetition_penalty", None)
+        if penalty is not None and penalty != 1.0:
+            procs.append(RepetitionPenaltyLogitsProcessor(penalty=float(penalty)))
+        if self.gen.do_sample:
+            if self.gen.temperature != 1.0:
+                procs.append(TemperatureLogitsWarper(self.gen.temperature))
+            if self.gen.top_k > 0:
+                procs.append(TopKLogitsWarper(top_k=self.gen.top_k))
+            if self.gen.top_p < 1.0:
+                procs.append(TopPLogitsWarper(top_p=self.gen.top_p))
+        return procs
+
+    def _get_prefix(self, sys_txt: str) -> Tuple[torch.Tensor, DynamicCache]:
+        hit = self._prefix_cache.get(sys_txt)
+        if hit is not None:
+            self._prefix_cache.move_to_end(sys_txt)
+            return hit
+
+        text = self.processor.apply_chat_template(
+            [{"role": "system", "content": [{"type": "text", "text": sys_txt}]}],
+            add_generation_prompt=False,
+            tokenize=False,
+        )
+        ids = self.processor.tokenizer(text, return_tensors="pt").input_ids.to(self.model.device)
+        # 시스템 턴은 텍스트뿐이라 M-RoPE 위치는 세 축 모두 0..L-1
+        pos = torch.arange(ids.shape[1], device=ids.device).view(1, 1, -1).expand(3, 1, -1)
+
+        with torch.inference_mode():
+            out = self.model(
+                inputs_embeds=self._embed(ids),
+                position_ids=pos,
+                attention_mask=torch.ones_like(ids),
+                past_key_values=DynamicCache(),
+                use_cache=True,
+            )
+
+        entry = (ids, out.past_key_values)
+        self._prefix_cache[sys_txt] = entry
+        while len(self._prefix_cache) > self.prefix_cache_size:
+            self._prefix_cache.popitem(last=False)
+        return entry
+
+    def new_timer(self) -> StageTimer:
+        return StageTimer(sync=torch.cuda.synchronize if self.device == "cuda" else None)
+
+    def preprocess(self, img_bytes: bytes, timer: Optional[StageTimer] = None) -> np.ndarray:
+        t: Dict[str, float] = {}
+        img = load_image(img_bytes, self.max_side, self.fast_filter_ratio, timings=t)
+        if timer is not None:
+            for name, sec in t.items():
+                timer.add(name, sec)
         return img
 
-    def explain(self, img_bytes: bytes, user_query: str, system_prompt: Optional[str] = None) -> Dict[str, Any]:
-        img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-        img = self._resize(img)
+    def _load_images(self, imgs: List[ImageInput], timer: StageTimer) -> List[np.ndarray]:
+        todo = [i for i, img in enumerate(imgs) if not isinstance(img, np.ndarray)]
+        out = list(imgs)
+        for i, arr in zip(todo, self.decode_pool.map(lambda b: self.preprocess(b, timer), [imgs[i] for i in todo])):
+            out[i] = arr
+        return out
 
+    def _build_prompt(self, img: np.ndarray, user_query: str, system_prompt: Optional[str]) -> str:
         sys_txt = SYSTEM_PROMPT if system_prompt is None else system_prompt
         usr_txt = USER_TEMPLATE.format(user_query=user_query)
 
@@ -84,32 +520,320 @@ class Explainer:
             ]},
         ]
 
-        prompt = self.processor.apply_chat_template(
+        return self.processor.apply_chat_template(
             messages,
             add_generation_prompt=True,
             tokenize=False,
         )
 
-        inputs = self.processor(
-            text=[prompt],
-            images=[img],
-            return_tensors="pt",
-        ).to(self.model.device)
+    def explain(self, img_bytes: ImageInput, user_query: str, system_prompt: Optional[str] = None,
+                on_delta: Optional[Callable[[str], None]] = None, session: Optional[str] = None,
+                new_scene: bool = True) -> Dict[str, Any]:
+        # 세션 id가 있으면 같은 장면의 후속 질문은 새 사용자 턴만 prefill
+        if session is not None and self.sessions is not None and not new_scene:
+            return self._explain_session(img_bytes, user_query, system_prompt, on_delta, session)
+        return self.explain_batch([(img_bytes, user_query, session)], system_prompt=system_prompt,
+                                  on_delta=on_delta)[0]
+
+    def release_session(self, session: str):
+        if self.sessions is not None:
+            self.sessions.drop(session)
+
+    def _explain_session(self, img_bytes: ImageInput, user_query: str, system_prompt: Optional[str],
+                         on_delta: Optional[Callable[[str], None]], session: str) -> Dict[str, Any]:
+        state = self.sessions.take(session)
+        new_state = None
+        try:
+            if state is None:
+                # 이어 갈 대화가 없음(첫 턴, 예산 초과로 제거됨): 새 대화로 시작 (진행 중 표시는 유지)
+                return self.explain_batch([(img_bytes, user_query, session)], system_prompt=system_prompt,
+                                          on_delta=on_delta)[0]
+            out, new_state = self._session_turn(state, user_query, on_delta)
+            return out
+        finally:
+            # 턴 도중에 release된 세션이면 put()이 저장하지 않음
+            self.sessions.put(session, new_state)
+
+    def _session_turn(self, state: SessionState, user_query: str,
+                      on_delta: Optional[Callable[[str], None]]) -> Tuple[Dict[str, Any], SessionState]:
+        query_types = [classify_query(user_query)]
+        stop = self._new_stop(query_types)
+        streamer = DeltaStreamer(self.processor.tokenizer, on_delta, skip_prompt=False) if on_delta else None
+        timer = self.new_timer()
+        BATCH_SIZE.observe(1)
+        tokens, kv, start_pos, history, mask = self._follow_up(state, user_query, timer, stop, streamer)
+
+        # 마지막 생성 토큰은 아직 kv에 없음: 다음 턴에 맨 앞에 넣음
+        n = tokens.shape[1]
+        new_state = SessionState(kv=kv, mask=torch.cat([mask, mask.new_ones(1, n - 1)], dim=1),
+                                 ids=torch.cat([history, tokens], dim=1), tail=tokens[:, -1:],
+                                 tail_pos=start_pos + n - 1, turn=state.turn + 1, bytes=_kv_bytes(kv))
+        out = self._postprocess(tokens, stop, query_types, timer)[0]
+        out["session_turn"] = new_state.turn
+        return out, new_state
+
+    def _row_state(self, i: int, tokens: torch.Tensor, kv: DynamicCache, mask: torch.Tensor, next_pos: torch.Tensor,
+                   prompt_ids: torch.Tensor) -> Optional[SessionState]:
+        # 배치 생성 결과에서 i번째 행의 대화 상태를 만듦
+        # 먼저 끝난 행 뒤에 채워진 패드 토큰은 kv에서 잘라냄 (kv = 프롬프트 + 마지막 토큰을 뺀 생성 토큰)
+        n = int((tokens[i] != self._pad_id).sum())
+        if n == 0:
+            return None
+        row_kv = _kv_row(kv, i, mask.shape[1] + n - 1)
+        real = mask[i].bool()
+        return SessionState(kv=row_kv, mask=torch.cat([mask[i:i + 1], mask.new_ones(1, n - 1)], dim=1),
+                            ids=torch.cat([prompt_ids[i][real], tokens[i, :n]])[None],
+                            tail=tokens[i:i + 1, n - 1:n], tail_pos=int(next_pos[i]) + n - 1, turn=1,
+                            bytes=_kv_bytes(row_kv))
+
+    def _follow_up(self, state: "SessionState", user_query: str, timer: StageTimer, stop: StopPolicies,
+                   streamer: Optional[TextStreamer],
+                   ) -> Tuple[torch.Tensor, DynamicCache, int, torch.Tensor, torch.Tensor]:
+        # (새 토큰, 디코드 후 kv, 첫 새 토큰의 위치, 대화 전체 ids, prefill 후 어텐션 마스크) 반환
+        dev = self.model.device
+        tok = self.processor.tokenizer
+        with timer.stage("template"):
+            # 이전 assistant 턴을 닫고(<|im_end|>로 이미 끝났으면 생략) 텍스트만 있는 사용자 턴을 엶
+            # 채팅 템플릿과 같은 형태를 직접 씀 (템플릿은 기본 시스템 턴을 끼워 넣으므로)
+            closed = int(state.tail[0, 0]) == self._im_end_id
+            text = ("" if closed else "<|im_end|>") + "\n<|im_start|>user\n" + \
+                USER_TEMPLATE.format(user_query=user_query) + "<|im_end|>\n<|im_start|>assistant\n"
+            new_ids = tok([text], return_tensors="pt", add_special_tokens=False).input_ids.to(dev)
+            ids = torch.cat([state.tail.to(dev), new_ids], dim=1)
+            # tail은 state.ids에 이미 들어 있음
+            history = torch.cat([state.ids.to(dev), new_ids], dim=1)
 
+        n = ids.shape[1]
+        with torch.inference_mode():
+            with timer.stage("prefill"):
+                # 텍스트 토큰은 M-RoPE 세 축이 함께 증가
+                pos = (state.tail_pos + torch.arange(n, device=dev)).view(1, 1, -1).expand(3, 1, -1)
+                mask = torch.cat([state.mask.to(dev), torch.ones(1, n, dtype=torch.long, device=dev)], dim=1)
+                out = self.model(inputs_embeds=self._embed(ids), position_ids=pos, attention_mask=mask,
+                                 past_key_values=state.kv, use_cache=True)
+            start_pos = state.tail_pos + n
+            with timer.stage("decode"):
+                tokens, kv = self._decode_loop(out, history, mask, torch.tensor([start_pos], device=dev), stop,
+                                               streamer)
+            self._record_decode(timer, "decode", int((tokens != self._pad_id).sum()))
+        return tokens, kv, start_pos, history, mask
+
+    def explain_batch(self, items: List[Tuple], system_prompt: Optional[str] = None,
+                      on_delta: Optional[Callable[[str], None]] = None) -> List[Dict[str, Any]]:
+        # items: (이미지, 질문) 또는 (이미지, 질문, 세션 id)
+        # 세션 id가 있는 행은 새 대화를 시작하고, 배치 kv에서 그 행만 떼어 세션에 저장 (세션 간 배치 유지)
+        if on_delta is not None and len(items) != 1:
+            raise ValueError("streaming is only supported for a single request")
+        sessions = [it[2] if len(it) > 2 and self.sessions is not None else None for it in items]
+        states: List[Optional[SessionState]] = [None] * len(items)
+        for session in sessions:
+            if session is not None:
+                self.sessions.take(session)
+        try:
+            outs = self._explain_batch(items, sessions, states, system_prompt, on_delta)
+        finally:
+            for session, state in zip(sessions, states):
+                if session is not None:
+                    self.sessions.put(session, state)
+        return outs
+
+    def _explain_batch(self, items: List[Tuple], sessions: List[Optional[str]], states: List[Optional[SessionState]],
+                       system_prompt: Optional[str], on_delta: Optional[Callable[[str], None]]) -> List[Dict[str, Any]]:
+        timer = self.new_timer()
+        BATCH_SIZE.observe(len(items))
+        imgs = self._load_images([it[0] for it in items], timer)
+        queries = [it[1] for it in items]
+        with timer.stage("template"):
+            prompts = [self._build_prompt(img, q, system_prompt) for img, q in zip(imgs, queries)]
+
+        query_types = [classify_query(q) for q in queries]
+        stop = self._new_stop(query_types)
+        tokens = None
+        if self.prefix_cache_enabled or self.vision_cache is not None or any(s is not None for s in sessions):
+            sys_txt = SYSTEM_PROMPT if system_prompt is None else system_prompt
+            streamer = DeltaStreamer(self.processor.tokenizer, on_delta, skip_prompt=False) if on_delta else None
+            res = self._generate_cached(imgs, prompts, sys_txt, timer, stop, streamer)
+            if res is not None:
+                tokens, kv, next_pos, prompt_ids, mask = res
+                for i, session in enumerate(sessions):
+                    if session is not None:
+                        states[i] = self._row_state(i, tokens, kv, mask, next_pos, prompt_ids)
+        if tokens is None:
+            # 캐시 경로를 못 쓰면 세션 상태 없이 응답 (다음 질문은 새 대화로 시작)
+            streamer = DeltaStreamer(self.processor.tokenizer, on_delta, skip_prompt=True) if on_delta else None
+            tokens = self._generate_hf(imgs, prompts, timer, stop, streamer)
+
+        outs = self._postprocess(tokens, stop, query_types, timer)
+        for out, session in zip(outs, sessions):
+            if session is not None:
+                out["session_turn"] = 1
+        return outs
+
+    def _postprocess(self, tokens: torch.Tensor, stop: StopPolicies, query_types: List[str],
+                     timer: StageTimer) -> List[Dict[str, Any]]:
+        # 새로 생성된 토큰만 디코딩하므로 텍스트 = 답변 (종료 정책이 자른 지점까지)
+        with timer.stage("postprocess"):
+            texts = self.processor.batch_decode(tokens, skip_special_tokens=True)
+            counts = (tokens != self._pad_id).sum(dim=1).tolist()
+        return [
+            {"explanation": stop.trim(i, t).strip(), "raw": t, "tokens": n, "stop_reason": stop.reason(i),
+             "query_type": qt, "timings": dict(timer.ms)}
+            for i, (t, n, qt) in enumerate(zip(texts, counts, query_types))
+        ]
+
+    def _new_stop(self, query_types: List[str]) -> StopPolicies:
+        return StopPolicies(self.processor.tokenizer, self._eos_ids, query_types, self.stop, self.gen.max_new_tokens)
+
+    def _record_decode(self, timer: StageTimer, stage: str, n_tokens: int):
+        GENERATED_TOKENS.inc(n_tokens)
+        sec = timer.ms.get(stage, 0.0) / 1000.0
+        if sec > 0:
+            DECODE_TPS.observe(n_tokens / sec)
+
+    def _generate_hf(self, imgs: List[np.ndarray], prompts: List[str], timer: StageTimer, stop: StopPolicies,
+                     streamer: Optional[TextStreamer] = None) -> torch.Tensor:
+        with timer.stage("processor"):
+            inputs = self.processor(
+                text=prompts,
+                images=imgs,
+                padding=True,
+                return_tensors="pt",
+            ).to(self.model.device)
+
+        # generate는 종료 조건에 전체 시퀀스를 넘기므로 프롬프트 부분은 건너뜀
+        stop.prompt_len = inputs["input_ids"].shape[1]
         gen_kwargs = dict(
             generation_config=self.model.generation_config,
-            max_new_tokens=self.gen.max_new_tokens,
+            max_new_tokens=stop.max_steps,
+            stopping_criteria=StoppingCriteriaList([stop]),
+            streamer=streamer,
         )
 
-        with torch.inference_mode():
+        # generate는 prefill과 decode를 한 번에 하므로 HF 경로는 둘을 합쳐서 기록
+        with torch.inference_mode(), timer.stage("generate"):
             output = self.model.generate(
                 **inputs,
                 **gen_kwargs,
             )
 
-        decoded = self.processor.batch_decode(output, skip_special_tokens=True)[0].strip()
+        new_tokens = output[:, inputs["input_ids"].shape[1]:]
+        self._record_decode(timer, "generate", int((new_tokens != self._pad_id).sum()))
+        return new_tokens
+
+    def _generate_cached(self, imgs: List[np.ndarray], prompts: List[str], sys_txt: str, timer: StageTimer,
+                         stop: StopPolicies, streamer: Optional[TextStreamer] = None,
+                         ) -> Optional[Tuple[torch.Tensor, DynamicCache, torch.Tensor, torch.Tensor, torch.Tensor]]:
+        # (새 토큰, 디코드 후 kv, 첫 새 토큰의 위치, 프롬프트 ids, 프롬프트 어텐션 마스크) 반환, HF 경로로 가야 하면 None
+        # 프롬프트 ids는 마스크와 같은 배치 (prefix | 패딩 | suffix)
+        if self.prefix_cache_enabled:
+            prefix_ids, prefix_kv = self._get_prefix(sys_txt)
+            plen = prefix_ids.shape[1]
+        else:
+            prefix_ids, prefix_kv, plen = None, None, 0
+        dev = self.model.device
+
+        with torch.inference_mode():
+            rows = []
+            for img, prompt in zip(imgs, prompts):
+                ids, img_embeds, grid_thw = self._encode_image_prompt(img, prompt, timer)
+                if plen and (ids.shape[1] <= plen or not torch.equal(ids[0, :plen], prefix_ids[0])):
+                    # 채팅 템플릿 결과가 캐시된 prefix와 다름: 캐시 없는 경로로
+                    return None
+
+                with timer.stage("processor"):
+                    pos, _ = self._rope_index(ids, grid_thw, None, torch.ones_like(ids))
+                    embeds = self._embed(ids)
+                    embeds[ids == self.model.config.image_token_id] = img_embeds.to(embeds.dtype)
+                rows.append((embeds[:, plen:], pos[:, :, plen:], ids))
+
+            with timer.stage("prefill"):
+                # 요청별 suffix만 prefill (공유 prefix 뒤에 suffix를 왼쪽 패딩으로 정렬)
+                bsz = len(rows)
+                slen = max(e.shape[1] for e, _, _ in rows)
+                suffix = rows[0][0].new_zeros(bsz, slen, rows[0][0].shape[-1])
+                pos = torch.ones(3, bsz, slen, dtype=torch.long, device=dev)
+                mask = torch.zeros(bsz, plen + slen, dtype=torch.long, device=dev)
+                mask[:, :plen] = 1
+                # repetition penalty는 generate와 같이 프롬프트 전체(prefix 포함)를 봄
+                prompt_ids = torch.full((bsz, plen + slen), self._pad_id, dtype=torch.long, device=dev)
+                for i, (e, p, ids) in enumerate(rows):
+                    n = e.shape[1]
+                    suffix[i, slen - n:] = e[0]
+                    pos[:, i, slen - n:] = p[:, 0]
+                    mask[i, plen + slen - n:] = 1
+                    prompt_ids[i, :plen] = ids[0, :plen]
+                    prompt_ids[i, plen + slen - n:] = ids[0, plen:]
+                next_pos = torch.stack([p.max() + 1 for _, p, _ in rows])
+
+                kv = copy.deepcopy(prefix_kv) if prefix_kv is not None else DynamicCache()
+                if bsz > 1 and prefix_kv is not None:
+                    kv.batch_repeat_interleave(bsz)
+
+                out = self.model(inputs_embeds=suffix, position_ids=pos, attention_mask=mask,
+                                 past_key_values=kv, use_cache=True)
+
+            with timer.stage("decode"):
+                tokens, kv = self._decode_loop(out, prompt_ids, mask, next_pos, stop, streamer)
+            self._record_decode(timer, "decode", int((tokens != self._pad_id).sum()))
+        return tokens, kv, next_pos, prompt_ids, mask
+
+    def _encode_image_prompt(self, img: np.ndarray, prompt: str,
+                             timer: StageTimer) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        # 이미지 한 장짜리 프롬프트의 (input_ids, 이미지 임베딩, grid_thw) 반환
+        dev = self.model.device
+        key = VisionCache.key(img) if self.vision_cache is not None else None
+        hit = self.vision_cache.get(key) if key is not None else None
+
+        if hit is not None:
+            img_embeds, grid_thw = hit
+            with timer.stage("processor"):
+                # 이미지 자리표시 토큰을 프로세서와 같은 방식으로 늘림 (픽셀은 건드리지 않음)
+                image_token = getattr(self.processor, "image_token", "<|image_pad|>")
+                n = int(grid_thw.prod()) // (self.processor.image_processor.merge_size ** 2)
+                text = prompt.replace(image_token, image_token * n, 1)
+                ids = self.processor.tokenizer([text], return_tensors="pt").input_ids.to(dev)
+            return ids, img_embeds, grid_thw
+
+        with timer.stage("processor"):
+            enc = self.processor(text=[prompt], images=[img], return_tensors="pt").to(dev)
+        with timer.stage("vision"):
+            vis_dtype = next(self._visual.parameters()).dtype
+            img_embeds = self._visual(enc["pixel_values"].type(vis_dtype), grid_thw=enc["image_grid_thw"])
+        if key is not None:
+            self.vision_cache.put(key, img_embeds, enc["image_grid_thw"])
+        return enc["input_ids"], img_embeds, enc["image_grid_thw"]
+
+    def _decode_loop(self, out, prompt_ids: torch.Tensor, mask: torch.Tensor, next_pos: torch.Tensor,
+                     stop: StopPolicies, streamer: Optional[TextStreamer] = None) -> Tuple[torch.Tensor, DynamicCache]:
+        # (생성된 ids, kv) 반환: kv에는 마지막 토큰을 뺀 모든 생성 토큰이 들어 있음
+        # 로짓 프로세서에는 generate와 같이 프롬프트 + 생성 토큰 전체를 넘김 (repetition penalty가 프롬프트도 봄)
+        bsz = mask.shape[0]
+        plen = prompt_ids.shape[1]
+        seq = prompt_ids
+        generated = seq[:, plen:]
+        unfinished = torch.ones(bsz, dtype=torch.bool, device=mask.device)
+
+        for step in range(stop.max_steps):
+            scores = self._logits_processor(seq, out.logits[:, -1, :].float())
+            if self.gen.do_sample:
+                tok = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+            else:
+                tok = scores.argmax(dim=-1)
+            tok = torch.where(unfinished, tok, torch.full_like(tok, self._pad_id))
+            seq = torch.cat([seq, tok[:, None]], dim=1)
+            generated = seq[:, plen:]
+            if streamer is not None:
+                streamer.put(tok.cpu())
+            unfinished &= ~torch.isin(tok, self._eos_ids)
+            unfinished &= ~stop(generated, scores)
+            if not unfinished.any() or step + 1 == stop.max_steps:
+                break
 
-        parts = [p.strip() for p in re.split(r"(?i)\b(system|user|assistant)\b", decoded) if p.strip()]
-        answer = parts[-1] if parts else decoded
+            mask = torch.cat([mask, mask.new_ones(bsz, 1)], dim=1)
+            pos = (next_pos + step).view(1, bsz, 1).expand(3, bsz, 1)
+            out = self.model(inputs_embeds=self._embed(tok[:, None]), position_ids=pos, attention_mask=mask,
+                             past_key_values=out.past_key_values, use_cache=True)
 
-        return {"explanation": answer, "raw": decoded}
+        if streamer is not None:
+            streamer.end()
+        return generated, out.past_key_values
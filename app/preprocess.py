@@ -0,0 +1,60 @@
+# app/preprocess.py
+# 이미지 전처리: JPEG 축소 디코딩 + 배율에 따른 리샘플링 필터 선택, 결과는 RGB numpy 배열 그대로 프로세서에 전달
+import io, time
+import cv2
+import numpy as np
+from PIL import Image
+from typing import Dict, Optional
+
+# 원본 PIL 경로와 같게 EXIF 회전은 적용하지 않음
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION,
+    2: cv2.IMREAD_REDUCED_COLOR_2 | cv2.IMREAD_IGNORE_ORIENTATION,
+    4: cv2.IMREAD_REDUCED_COLOR_4 | cv2.IMREAD_IGNORE_ORIENTATION,
+    8: cv2.IMREAD_REDUCED_COLOR_8 | cv2.IMREAD_IGNORE_ORIENTATION,
+}
+
+def _reduce_factor(img_bytes: bytes, max_side: int) -> int:
+    # 헤더만 읽어 크기/포맷 확인 (PIL.Image.open은 픽셀을 디코딩하지 않음)
+    try:
+        with Image.open(io.BytesIO(img_bytes)) as probe:
+            w, h = probe.size
+            fmt = probe.format
+    except Exception:
+        return 1
+    if fmt != "JPEG":
+        return 1
+    # 축소 디코딩 후에도 max_side 이상이 남는 가장 큰 1/2^n
+    factor = 1
+    while factor < 8 and max(w, h) // (factor * 2) >= max_side:
+        factor *= 2
+    return factor
+
+def load_image(img_bytes: bytes, max_side: int, fast_filter_ratio: float = 2.0,
+               timings: Optional[Dict[str, float]] = None) -> np.ndarray:
+    # timings가 주어지면 "decode"/"resize" 소요 시간(초)을 채움
+    t0 = time.perf_counter()
+    buf = np.frombuffer(img_bytes, dtype=np.uint8)
+    img = cv2.imdecode(buf, _REDUCED_FLAGS[_reduce_factor(img_bytes, max_side)])
+    is_bgr = img is not None
+    if not is_bgr:
+        # OpenCV가 못 읽는 포맷(GIF 등)은 PIL로
+        pil = Image.open(io.BytesIO(img_bytes))
+        pil.draft("RGB", (max_side, max_side))
+        img = np.asarray(pil.convert("RGB"))
+    t1 = time.perf_counter()
+
+    h, w = img.shape[:2]
+    scale = max_side / max(w, h)
+    if scale < 1.0:
+        size = (max(1, int(w * scale)), max(1, int(h * scale)))
+        # 크게 줄일 때는 INTER_AREA(저렴하고 에일리어싱 적음), 살짝 줄일 때만 LANCZOS
+        interp = cv2.INTER_AREA if (1.0 / scale) >= fast_filter_ratio else cv2.INTER_LANCZOS4
+        img = cv2.resize(img, size, interpolation=interp)
+
+    # 색 변환은 줄인 뒤에 한 번만
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB) if is_bgr else np.ascontiguousarray(img)
+    if timings is not None:
+        timings["decode"] = t1 - t0
+        timings["resize"] = time.perf_counter() - t1
+    return img
@@ -1,60 +1,170 @@
 # app/rt_server.py  (전체 교체)
-import io, yaml, base64, asyncio, json, time
-from typing import Optional
+import logging, io, yaml, uuid, base64, asyncio, json, time, struct
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Tuple
 from PIL import Image
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from starlette.websockets import WebSocketState
-from .pipeline import Explainer  # ZeroShotExplainer → Explainer (explain(img_bytes, user_query))
+from .backend import make_backend, NotReady
+from .scheduler import QueueFull, DeadlineExceeded, PRIORITY_LOW
+from .frame_cache import FrameAnswerCache
+from .scene import SceneGate
+from .stt import SpeechToText, VadSegmenter, SAMPLE_RATE, resample_pcm16
+from .metrics import REGISTRY, StageTimer
 
-app = FastAPI(title="Zero-shot Vision Explainer (RealTime)")
-pipe = Explainer(cfg_path="config.yml")
+# uvicorn은 자기 로거만 설정하므로 앱 로그(모델 로드 정보 등)는 여기서 출력
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+with open("config.yml", "r", encoding="utf-8") as f:
+    cfg = yaml.safe_load(f)
+# serving.mode=local이면 이 프로세스에 모델 로드, remote면 모델 호스트로 전달만 (세션은 같은 호스트에 고정)
+backend = make_backend(cfg, "config.yml")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 모델은 백그라운드에서 로드: 준비 전 웹소켓은 1013(try again later)으로 닫음
+    await backend.start()
+    if stt is not None:
+        await stt.start()
+    yield
+
+app = FastAPI(title="Zero-shot Vision Explainer (RealTime)", lifespan=lifespan)
+# 실시간 프레임은 금방 낡으므로 짧은 데드라인으로 제출
+RT_DEADLINE_MS = int((cfg.get("scheduler") or {}).get("rt_deadline_ms", 2000))
+# 토큰 스트리밍: 생성되는 대로 {"type":"delta"} 전송 (끄면 배치 경로 사용)
+RT_STREAM = bool((cfg.get("stream") or {}).get("realtime", True))
+# 같은 장면 + 같은 질문이면 모델 호출 없이 이전 설명을 재사용 (세션 간 공유)
+frame_cache = FrameAnswerCache.from_cfg(cfg)
+# 세션 대화 캐시(KV)가 켜져 있으면 같은 장면의 후속 질문은 이전 대화에 이어 붙임 (프레임 캐시를 거치지 않음)
+SESSIONS = bool((cfg.get("session_cache") or {}).get("enabled", True))
+# 응답에 단계별 소요시간(ms) 포함 여부
+RT_TIMINGS = bool((cfg.get("metrics") or {}).get("per_request_timings", False))
+# 음성 질문: 세션마다 VAD로 발화를 자르고, 인식은 공용 STT 워커 풀에서
+# (엔진은 lifespan에서 백그라운드 로드, 준비 전이거나 로드 실패/비활성이면 음성 무시)
+stt = SpeechToText.from_cfg(cfg)
+
+FRAMES_RECEIVED = REGISTRY.counter("rt_frames_received_total", "Frames received over /ws")
+FRAMES_DROPPED = REGISTRY.counter("rt_frames_dropped_total", "Frames overwritten in LatestFrameQueue before being consumed")
+FRAME_QUEUE_WAIT = REGISTRY.histogram("rt_frame_queue_wait_seconds", "Time the latest frame waited for the consumer")
+RT_INFER_SECONDS = REGISTRY.histogram("rt_inference_seconds", "Realtime inference latency per answered frame", ("cached",))
+if frame_cache is not None:
+    REGISTRY.gauge("rt_frame_cache_hits", "Frame answer cache hits", lambda: frame_cache.hits)
+    REGISTRY.gauge("rt_frame_cache_misses", "Frame answer cache misses", lambda: frame_cache.misses)
 
 # 로고 서빙 (프로젝트 루트의 logo.png)
 @app.get("/logo.png")
 async def get_logo():
     return FileResponse("logo.png")
 
+@app.get("/health/live")
+async def health_live():
+    return {"ok": True}
+
+@app.get("/health/ready")
+async def health_ready():
+    return JSONResponse({"ok": backend.ready, **backend.stats()}, status_code=200 if backend.ready else 503)
+
+@app.get("/stats")
+async def stats():
+    return {
+        "backend": backend.stats(),
+        "frame_cache": frame_cache.stats() if frame_cache else None,
+        "stt": stt.state if stt else None,
+    }
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 # 단일 소비자 큐(프레임 과부하 방지): 최근 프레임만 유지
 class LatestFrameQueue:
     def __init__(self):
-        self._item: Optional[bytes] = None
+        self._item: Optional[Tuple[bytes, Dict[str, Any]]] = None
         self._event = asyncio.Event()
+        self._put_t = 0.0
 
-    def put(self, item: bytes):
-        self._item = item
+    def put(self, item: bytes, meta: Optional[Dict[str, Any]] = None):
+        FRAMES_RECEIVED.inc()
+        if self._event.is_set():
+            # 소비자가 가져가기 전에 덮어씀 = 드롭
+            FRAMES_DROPPED.inc()
+        self._item = (item, meta or {})
+        self._put_t = time.perf_counter()
         if not self._event.is_set():
             self._event.set()
 
-    async def get(self) -> bytes:
+    async def get(self) -> Tuple[bytes, Dict[str, Any]]:
         await self._event.wait()
         self._event.clear()
+        FRAME_QUEUE_WAIT.observe(time.perf_counter() - self._put_t)
         return self._item
 
+    def kick(self):
+        # 새 프레임 없이도 마지막 프레임으로 소비자를 깨움 (질문이 바뀐 경우)
+        if self._item is not None and not self._event.is_set():
+            self._event.set()
+
 def decode_dataurl_image(data_url: str) -> bytes:
     # "data:image/webp;base64,...."
     header, b64 = data_url.split(",", 1)
     return base64.b64decode(b64)
 
-async def transcribe_audio_stub(b64_data: str, mime: str) -> str:
-    # TODO: STT 엔진(Whisper 등) 연결
-    # 현재는 비워둠(서버가 텍스트를 못 만들면 기존 user_query 유지)
-    return ""
+# 바이너리 프레임 헤더 (big-endian 16바이트): seq(uint32) | capture_ts(float64, epoch ms) | query_id(uint32)
+# 헤더 뒤는 JPEG/WebP 원본 바이트 그대로
+FRAME_HEADER = struct.Struct(">IdI")
+
+def decode_binary_frame(data: bytes) -> Tuple[bytes, Dict[str, Any]]:
+    seq, capture_ts, query_id = FRAME_HEADER.unpack_from(data, 0)
+    meta = {"seq": seq, "capture_ts": capture_ts, "query_id": query_id, "recv_ts": time.time() * 1000.0}
+    return data[FRAME_HEADER.size:], meta
 
 @app.websocket("/ws")
 async def websocket_endpoint(ws: WebSocket):
     await ws.accept()
+    if not backend.ready:
+        await ws.close(code=1013, reason="model loading")
+        return
     q = LatestFrameQueue()
+    gate = SceneGate.from_cfg(cfg)
+    session = uuid.uuid4().hex
     running = True
+    vad = VadSegmenter.from_cfg(cfg)
+    stt_tasks = set()
 
     # 상태: 최신 텍스트 질문
     latest_query: str = ""
 
+    async def on_utterance(pcm: bytes):
+        # 발화가 끝나는 즉시 인식 → 질문 교체 → 마지막 프레임으로 바로 추론
+        nonlocal latest_query
+        text = (await stt.transcribe(pcm)).strip()
+        if not text:
+            return
+        latest_query = text
+        q.kick()
+        await ws.send_text(json.dumps({"type": "transcript", "text": text}, ensure_ascii=False))
+
+    def spawn_stt(pcm: Optional[bytes]):
+        if pcm:
+            t = asyncio.create_task(on_utterance(pcm))
+            stt_tasks.add(t)
+            t.add_done_callback(stt_tasks.discard)
+
     async def producer():
         nonlocal running, latest_query
         try:
             while running and ws.application_state == WebSocketState.CONNECTED:
-                msg = await ws.receive_text()
+                raw = await ws.receive()
+                if raw["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(raw.get("code", 1000))
+
+                # 바이너리 메시지 = 헤더 + 이미지 바이트 (제어 메시지는 계속 텍스트/JSON)
+                if raw.get("bytes") is not None:
+                    if len(raw["bytes"]) > FRAME_HEADER.size:
+                        img_bytes, meta = decode_binary_frame(raw["bytes"])
+                        q.put(img_bytes, meta)
+                    continue
+                msg = raw.get("text") or ""
 
                 # 하위호환: 순수 dataURL만 오는 경우(이전 클라이언트)
                 if msg.startswith("data:image"):
@@ -76,13 +186,16 @@ async def websocket_endpoint(ws: WebSocket):
                         q.put(img_bytes)
                 elif mtype == "text":
                     latest_query = str(obj.get("user_query", "")).strip()
-                elif mtype == "audio":
+                    q.kick()
+                elif mtype == "audio" and stt is not None and stt.ready:
+                    # {type: "audio", data: base64(16bit 모노 PCM), rate: 16000, final?: true}
                     b64 = obj.get("data", "")
-                    mime = obj.get("mime", "audio/webm")
                     if isinstance(b64, str) and b64:
-                        text = await transcribe_audio_stub(b64, mime)
-                        if text:
-                            latest_query = text.strip()
+                        pcm = resample_pcm16(base64.b64decode(b64), int(obj.get("rate", SAMPLE_RATE)))
+                        for utt in vad.feed(pcm):
+                            spawn_stt(utt)
+                    if obj.get("final"):
+                        spawn_stt(vad.flush())
                 else:
                     # ignore unknown
                     pass
@@ -94,28 +207,88 @@ async def websocket_endpoint(ws: WebSocket):
     async def consumer():
         nonlocal running, latest_query
         try:
-            throttle_ms = 600
-            last_t = 0.0
             while running and ws.application_state == WebSocketState.CONNECTED:
-                img_bytes = await q.get()
-                now_ms = time.time() * 1000.0
-                if now_ms - last_t < throttle_ms:
-                    await asyncio.sleep((throttle_ms - (now_ms - last_t)) / 1000.0)
+                img_bytes, meta = await q.get()
+                query = latest_query or "이게 뭐야?"
+
+                # 장면 변화/질문 변화가 있으면 즉시, 안정적이면 점점 드물게 추론
+                fire, trigger = await asyncio.to_thread(gate.update, img_bytes, query)
+                if not fire:
+                    continue
+                # 같은 장면에서 질문만 바뀐 경우에만 이전 대화(KV)에 새 질문을 이어 붙임
+                # init/scene은 새 이미지로 대화를 새로 시작, refresh는 같은 장면 재확인이라 대화는 두고 세션 없이 추론
+                new_scene = trigger != "query"
+                turn_session = None if trigger == "refresh" else session
+                # 후속 질문의 답은 대화 맥락에 따라 다르므로 프레임 캐시에서 꺼내지도, 넣지도 않음
+                use_cache = frame_cache is not None and not (SESSIONS and not new_scene)
 
                 t0 = time.time()
-                # pipeline 호출: 최신 텍스트 질문 동봉
-                out = pipe.explain(img_bytes=img_bytes, user_query=latest_query or "이게 뭐야?")
+                ttft_ms = None
+                out, phash = None, None
+                if use_cache:
+                    phash = await asyncio.to_thread(frame_cache.hash, img_bytes)
+                    out = frame_cache.get(phash, query)
+                cached = out is not None
+                if cached and turn_session is not None:
+                    # 캐시 답으로 새 장면의 턴을 건너뜀: 세션에는 이전 장면의 대화가 남아 있으므로 버림
+                    # (다음 후속 질문은 지금 프레임으로 새 대화를 시작)
+                    await backend.release(session)
+                pre = StageTimer()
+
+                if not cached:
+                    img = await backend.preprocess(img_bytes, pre)
+                    # pipeline 호출: 최신 텍스트 질문 동봉 (워커 스레드에서 실행, 루프는 블로킹되지 않음)
+                    try:
+                        if RT_STREAM:
+                            events = backend.explain_stream(
+                                img, query,
+                                priority=PRIORITY_LOW, deadline_ms=RT_DEADLINE_MS,
+                                session=turn_session, new_scene=new_scene,
+                            )
+                            async for kind, value in events:
+                                if kind == "delta":
+                                    if ttft_ms is None:
+                                        ttft_ms = int((time.time() - t0) * 1000)
+                                    await ws.send_text(json.dumps(
+                                        {"type": "delta", "text": value, "seq": meta.get("seq")}, ensure_ascii=False
+                                    ))
+                                else:
+                                    out = value
+                        else:
+                            out = await backend.explain(
+                                img, query,
+                                priority=PRIORITY_LOW, deadline_ms=RT_DEADLINE_MS,
+                                session=turn_session, new_scene=new_scene,
+                            )
+                    except (QueueFull, DeadlineExceeded, NotReady):
+                        # 과부하(또는 호스트 재시작 중): 이 프레임은 버리고 다음 최신 프레임을 기다림
+                        continue
+                    if use_cache:
+                        frame_cache.put(phash, query, out)
                 dt_ms = int((time.time() - t0) * 1000)
+                RT_INFER_SECONDS.observe(dt_ms / 1000.0, cached=str(cached).lower())
 
-                payload = json.dumps(
-                    {"explanation": out.get("explanation", ""), "latency_ms": dt_ms},
-                    ensure_ascii=False
-                )
+                # 바이너리 프레임이면 seq/capture_ts를 그대로 돌려줘 클라이언트가 종단 간 지연을 계산
+                result = {"type": "result", "explanation": out.get("explanation", ""), "latency_ms": dt_ms,
+                          "ttft_ms": ttft_ms, "tokens": None if cached else out.get("tokens"),
+                          "stop_reason": out.get("stop_reason"), "session_turn": out.get("session_turn"),
+                          "cached": cached, "trigger": trigger, **meta}
+                if RT_TIMINGS:
+                    result["timings"] = {} if cached else {**pre.ms, **out.get("timings", {})}
+                payload = json.dumps(result, ensure_ascii=False)
                 await ws.send_text(payload)
-                last_t = time.time() * 1000.0
         except WebSocketDisconnect:
             running = False
         except Exception:
             running = False
 
-    await asyncio.gather(producer(), consumer())
+    tasks = [asyncio.ensure_future(producer()), asyncio.ensure_future(consumer())]
+    try:
+        # 한쪽이 끝나면(연결 끊김, 전송 실패) 다른 쪽도 끝냄: 소비자는 새 프레임이 없으면 q.get()에서 계속 기다림
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for t in tasks + list(stt_tasks):
+            t.cancel()
+        # 세션 대화 캐시(KV)와 원격 호스트 고정 정리 (아직 돌고 있는 턴이 있어도 그 턴은 결과를 저장하지 않음)
+        await backend.release(session)
+        await asyncio.gather(*tasks, return_exceptions=True)
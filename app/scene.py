@@ -0,0 +1,84 @@
+# app/scene.py
+# 장면 변화 기반 추론 게이트: 고정 쓰로틀 대신 장면이 바뀌거나 질문이 바뀌면 즉시 추론,
+# 장면이 안정적이면 재추론 간격을 지수적으로 늘림
+import time
+import cv2
+import numpy as np
+from typing import Any, Dict, Optional, Tuple
+
+class SceneGate:
+    def __init__(self, thumb_size: int = 64, diff_threshold: float = 12.0, hist_threshold: float = 0.90,
+                 min_interval_ms: int = 500, max_interval_ms: int = 8000, backoff: float = 2.0):
+        self.thumb_size = int(thumb_size)
+        self.diff_threshold = float(diff_threshold)
+        self.hist_threshold = float(hist_threshold)
+        self.min_interval_ms = int(min_interval_ms)
+        self.max_interval_ms = int(max_interval_ms)
+        self.backoff = float(backoff)
+
+        self._ref: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._query: Optional[str] = None
+        self._last_fire = 0.0
+        self.interval_ms = float(self.min_interval_ms)
+
+    @classmethod
+    def from_cfg(cls, cfg: Dict[str, Any]) -> "SceneGate":
+        s = (cfg.get("scene") or {})
+        return cls(
+            thumb_size=int(s.get("thumb_size", 64)),
+            diff_threshold=float(s.get("diff_threshold", 12.0)),
+            hist_threshold=float(s.get("hist_threshold", 0.90)),
+            min_interval_ms=int(s.get("min_interval_ms", 500)),
+            max_interval_ms=int(s.get("max_interval_ms", 8000)),
+            backoff=float(s.get("backoff", 2.0)),
+        )
+
+    def _features(self, img_bytes: bytes) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        buf = np.frombuffer(img_bytes, dtype=np.uint8)
+        # 1/4 축소 디코딩 (JPEG은 디코더 단계에서 축소되어 저렴함)
+        gray = cv2.imdecode(buf, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if gray is None:
+            gray = cv2.imdecode(buf, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            return None
+        thumb = cv2.resize(gray, (self.thumb_size, self.thumb_size), interpolation=cv2.INTER_AREA)
+        hist = cv2.calcHist([thumb], [0], None, [32], [0, 256])
+        cv2.normalize(hist, hist)
+        return thumb, hist
+
+    def _changed(self, feat: Tuple[np.ndarray, np.ndarray]) -> bool:
+        ref_thumb, ref_hist = self._ref
+        thumb, hist = feat
+        diff = float(cv2.absdiff(thumb, ref_thumb).mean())
+        corr = float(cv2.compareHist(ref_hist, hist, cv2.HISTCMP_CORREL))
+        return diff > self.diff_threshold or corr < self.hist_threshold
+
+    def update(self, img_bytes: bytes, query: str) -> Tuple[bool, str]:
+        # (추론 여부, 사유) — 사유: init | query | scene | refresh | stable
+        # query = 같은 장면에서 질문만 바뀜 (장면도 바뀌었으면 scene)
+        feat = self._features(img_bytes)
+        now = time.monotonic()
+
+        if feat is None:
+            return False, "stable"
+        if self._ref is None:
+            reason = "init"
+        elif self._changed(feat):
+            reason = "scene"
+        elif query != self._query:
+            reason = "query"
+        elif (now - self._last_fire) * 1000.0 >= self.interval_ms:
+            reason = "refresh"
+        else:
+            return False, "stable"
+
+        if reason == "refresh":
+            self.interval_ms = min(self.interval_ms * self.backoff, float(self.max_interval_ms))
+        else:
+            self.interval_ms = float(self.min_interval_ms)
+        # 기준 프레임은 장면이 바뀔 때만 갱신: 조금씩 움직인 변화도 누적되면 scene으로 잡힘
+        if reason in ("init", "scene"):
+            self._ref = feat
+        self._query = query
+        self._last_fire = now
+        return True, reason
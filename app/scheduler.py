@@ -0,0 +1,223 @@
+# app/scheduler.py
+# 추론 전용 스케줄러: 블로킹 generate를 이벤트 루프 밖(워커 스레드)에서 실행
+import asyncio, heapq, itertools, threading, time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from .metrics import REGISTRY, QUEUE_WAIT_SECONDS
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+# 대량 일괄 처리(/infer/batch): 실시간 프레임보다도 뒤
+PRIORITY_BULK = 3
+
+class QueueFull(Exception):
+    pass
+
+class DeadlineExceeded(Exception):
+    pass
+
+@dataclass(order=True)
+class Job:
+    priority: int
+    seq: int
+    deadline: float = field(compare=False)
+    fn: Callable[..., Any] = field(compare=False)
+    args: tuple = field(compare=False)
+    kwargs: Dict[str, Any] = field(compare=False)
+    loop: asyncio.AbstractEventLoop = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    # 배치 가능한 작업: 같은 (fn, batch_key)끼리 묶어서 fn([item, ...], **kwargs) 한 번으로 실행
+    batched: bool = field(default=False, compare=False)
+    batch_key: Any = field(default=None, compare=False)
+    queued_at: float = field(default_factory=time.monotonic, compare=False)
+
+def _resolve(fut: asyncio.Future, result: Any = None, exc: Optional[BaseException] = None):
+    if fut.done():
+        return
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(result)
+
+class InferenceScheduler:
+    def __init__(self, max_queue: int = 16, deadline_ms: int = 30000, workers: int = 1,
+                 max_batch: int = 1, max_wait_ms: int = 0):
+        self.max_queue = max(1, int(max_queue))
+        self.deadline_ms = int(deadline_ms)
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_ms = max(0, int(max_wait_ms))
+        self._heap = []
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "shed": 0, "expired": 0, "running": 0, "batches": 0}
+
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"infer-worker-{i}", daemon=True)
+            for i in range(max(1, int(workers)))
+        ]
+        for t in self._threads:
+            t.start()
+
+        REGISTRY.gauge("scheduler_queue_depth", "Jobs waiting in the inference queue", self.qsize)
+        for key in ("running", "shed", "expired", "failed", "completed"):
+            REGISTRY.gauge(f"scheduler_{key}", f"Inference scheduler '{key}' count", lambda k=key: self.stats[k])
+
+    @classmethod
+    def from_cfg(cls, cfg: Dict[str, Any]) -> "InferenceScheduler":
+        s = (cfg.get("scheduler") or {})
+        b = (cfg.get("batch") or {})
+        return cls(
+            max_queue=int(s.get("max_queue", 16)),
+            deadline_ms=int(s.get("deadline_ms", 30000)),
+            workers=int(s.get("workers", 1)),
+            max_batch=int(b.get("max_size", 1)),
+            max_wait_ms=int(b.get("max_wait_ms", 0)),
+        )
+
+    def qsize(self) -> int:
+        with self._cv:
+            return len(self._heap)
+
+    async def submit(self, fn: Callable[..., Any], *args,
+                     priority: int = PRIORITY_NORMAL, deadline_ms: Optional[int] = None, **kwargs) -> Any:
+        return await self._enqueue(fn, args, kwargs, priority, deadline_ms)
+
+    async def submit_batched(self, fn: Callable[..., List[Any]], item: Any, batch_key: Any = None,
+                             priority: int = PRIORITY_NORMAL, deadline_ms: Optional[int] = None, **kwargs) -> Any:
+        # fn은 item 리스트를 받아 같은 순서의 결과 리스트를 돌려줘야 함
+        return await self._enqueue(fn, (item,), kwargs, priority, deadline_ms, batched=True, batch_key=batch_key)
+
+    def submit_stream(self, fn: Callable[..., Any], *args,
+                      priority: int = PRIORITY_NORMAL, deadline_ms: Optional[int] = None,
+                      **kwargs) -> AsyncIterator[Tuple[str, Any]]:
+        # fn(..., on_delta=cb)이 워커 스레드에서 부르는 cb(text)를 ("delta", text)로, 끝나면 ("result", 결과)를 흘려줌
+        # 큐가 가득 차면 여기서 바로 QueueFull (응답을 시작하기 전에 거절할 수 있도록)
+        loop = asyncio.get_running_loop()
+        deltas: asyncio.Queue = asyncio.Queue()
+        kwargs["on_delta"] = lambda text: loop.call_soon_threadsafe(deltas.put_nowait, text)
+        fut = self._push(fn, args, kwargs, priority, deadline_ms)
+        fut.add_done_callback(lambda _: deltas.put_nowait(None))
+        return self._drain(deltas, fut)
+
+    async def _drain(self, deltas: asyncio.Queue, fut: asyncio.Future) -> AsyncIterator[Tuple[str, Any]]:
+        try:
+            while True:
+                text = await deltas.get()
+                if text is None:
+                    break
+                yield "delta", text
+            yield "result", fut.result()
+        finally:
+            if not fut.done():
+                fut.cancel()
+
+    async def _enqueue(self, fn, args, kwargs, priority, deadline_ms, batched=False, batch_key=None) -> Any:
+        return await self._push(fn, args, kwargs, priority, deadline_ms, batched, batch_key)
+
+    def _push(self, fn, args, kwargs, priority, deadline_ms, batched=False, batch_key=None) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        ttl = self.deadline_ms if deadline_ms is None else int(deadline_ms)
+        job = Job(priority, next(self._seq), time.monotonic() + ttl / 1000.0, fn, args, kwargs, loop, fut,
+                  batched=batched, batch_key=batch_key)
+
+        with self._cv:
+            self._drop_expired_locked()
+            if len(self._heap) >= self.max_queue:
+                # 큐가 가득 차면: 새 작업이 더 급하면 가장 덜 급한 작업을 밀어내고, 아니면 거절
+                worst = max(self._heap)
+                if not job < worst:
+                    self.stats["shed"] += 1
+                    raise QueueFull("inference queue is full")
+                self._heap.remove(worst)
+                heapq.heapify(self._heap)
+                self.stats["shed"] += 1
+                worst.loop.call_soon_threadsafe(_resolve, worst.future, None, QueueFull("shed by higher-priority request"))
+            heapq.heappush(self._heap, job)
+            self.stats["submitted"] += 1
+            self._cv.notify()
+
+        return fut
+
+    def _drop_expired_locked(self):
+        now = time.monotonic()
+        alive = []
+        for job in self._heap:
+            if job.future.cancelled():
+                continue
+            if job.deadline < now:
+                self.stats["expired"] += 1
+                job.loop.call_soon_threadsafe(_resolve, job.future, None, DeadlineExceeded("deadline exceeded in queue"))
+                continue
+            alive.append(job)
+        if len(alive) != len(self._heap):
+            heapq.heapify(alive)
+            self._heap = alive
+
+    def _next_job(self) -> Job:
+        with self._cv:
+            while not self._heap:
+                self._cv.wait()
+            return heapq.heappop(self._heap)
+
+    def _collect_batch(self, first: Job) -> List[Job]:
+        # 첫 작업과 같은 종류의 대기 작업을 max_wait_ms 동안 max_batch까지 모음
+        jobs = [first]
+        if not first.batched or self.max_batch <= 1:
+            return jobs
+        until = time.monotonic() + self.max_wait_ms / 1000.0
+        with self._cv:
+            while True:
+                for job in sorted(self._heap):
+                    if len(jobs) >= self.max_batch:
+                        break
+                    if job.batched and job.fn is first.fn and job.batch_key == first.batch_key:
+                        self._heap.remove(job)
+                        jobs.append(job)
+                heapq.heapify(self._heap)
+                remaining = until - time.monotonic()
+                if len(jobs) >= self.max_batch or remaining <= 0:
+                    return jobs
+                self._cv.wait(remaining)
+
+    def _worker(self):
+        while True:
+            first = self._next_job()
+            now = time.monotonic()
+            live = []
+            for job in self._collect_batch(first):
+                if job.future.cancelled():
+                    continue
+                if job.deadline < now:
+                    # 오래된 작업은 실행하지 않고 바로 버림
+                    with self._cv:
+                        self.stats["expired"] += 1
+                    job.loop.call_soon_threadsafe(_resolve, job.future, None, DeadlineExceeded("deadline exceeded in queue"))
+                    continue
+                QUEUE_WAIT_SECONDS.observe(now - job.queued_at)
+                live.append(job)
+            if not live:
+                continue
+
+            with self._cv:
+                self.stats["running"] += len(live)
+                self.stats["batches"] += 1
+            try:
+                if first.batched:
+                    results = first.fn([job.args[0] for job in live], **first.kwargs)
+                else:
+                    results = [first.fn(*first.args, **first.kwargs)]
+            except Exception as e:
+                with self._cv:
+                    self.stats["failed"] += len(live)
+                for job in live:
+                    job.loop.call_soon_threadsafe(_resolve, job.future, None, e)
+            else:
+                with self._cv:
+                    self.stats["completed"] += len(live)
+                for job, result in zip(live, results):
+                    job.loop.call_soon_threadsafe(_resolve, job.future, result)
+            finally:
+                with self._cv:
+                    self.stats["running"] -= len(live)
@@ -1,17 +1,186 @@
 # app/server.py
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse
-from .pipeline import Explainer
+import io, logging, json, time, wave, yaml, asyncio, zipfile
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+from fastapi import FastAPI, Request, UploadFile, File, Form
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from .backend import make_backend, NotReady
+from .scheduler import QueueFull, DeadlineExceeded, PRIORITY_BULK
+from .metrics import REGISTRY, REQUEST_SECONDS, StageTimer
+from .stt import SpeechToText
+from .batch import zip_items, result_line
 
-app = FastAPI(title="Vision Explainer")
-pipe = Explainer(cfg_path="config.yml")
+# uvicorn은 자기 로거만 설정하므로 앱 로그(모델 로드 정보 등)는 여기서 출력
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+with open("config.yml", "r", encoding="utf-8") as f:
+    cfg = yaml.safe_load(f)
+# serving.mode=local이면 이 프로세스에 모델 로드, remote면 모델 호스트로 전달만
+backend = make_backend(cfg, "config.yml")
+# 질문 대신 음성(WAV)이 올라오면 STT로 질문을 만듦 (엔진은 lifespan에서 백그라운드 로드)
+stt = SpeechToText.from_cfg(cfg)
+# /infer/batch: 대량 요청은 낮은 우선순위 + 긴 데드라인, 동시에 큐에 올리는 개수 제한
+BATCH_API = (cfg.get("batch_api") or {})
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 모델은 백그라운드에서 로드: 그동안 /health, /health/live는 200, 나머지는 503
+    await backend.start()
+    if stt is not None:
+        await stt.start()
+    yield
+
+app = FastAPI(title="Vision Explainer", lifespan=lifespan)
+
+@app.exception_handler(NotReady)
+async def not_ready(request: Request, exc: NotReady):
+    return JSONResponse({"error": "loading"}, status_code=503, headers={"Retry-After": "5"})
+
+def with_timings(out: Dict[str, Any], pre: StageTimer, enabled: bool) -> Dict[str, Any]:
+    # 단계별 소요시간(ms)은 ?timings=true 일 때만 응답에 포함
+    out = dict(out)
+    stages = out.pop("timings", {})
+    if enabled:
+        out["timings"] = {**pre.ms, **stages}
+    return out
+
+# /health는 기존처럼 liveness (로드 중에도 200): 기존 liveness 프로브가 로드 중 재시작 루프에 빠지지 않도록
+# 트래픽 투입 여부는 /health/ready로 판단
 @app.get("/health")
-async def health():
+@app.get("/health/live")
+async def health_live():
     return {"ok": True}
 
+@app.get("/health/ready")
+async def health_ready():
+    # 로드 + 워밍업이 끝나야 200 (롤링 재시작 시 준비된 인스턴스로만 트래픽이 가도록)
+    return JSONResponse({"ok": backend.ready, **backend.stats()}, status_code=200 if backend.ready else 503)
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/infer")
-async def infer(image: UploadFile = File(...), user_query: str = Form(...)):
+async def infer(image: UploadFile = File(...), user_query: str = Form(""), audio: Optional[UploadFile] = File(None),
+                timings: bool = False):
+    t0 = time.perf_counter()
+    img_bytes = await image.read()
+    transcript = None
+    if audio is not None and not user_query.strip():
+        if stt is None or stt.state == "failed":
+            return JSONResponse({"error": "speech-to-text is not available"}, status_code=501)
+        if not stt.ready:
+            raise NotReady(stt.state)
+        try:
+            transcript = await stt.transcribe_wav(await audio.read())
+        except (wave.Error, EOFError, ValueError):
+            return JSONResponse({"error": "audio must be a PCM WAV file"}, status_code=400)
+        user_query = transcript
+    pre = StageTimer()
+    img = await backend.preprocess(img_bytes, pre)
+    try:
+        out = await backend.explain(img, user_query or "이게 뭐야?")
+    except QueueFull:
+        return JSONResponse({"error": "busy"}, status_code=429, headers={"Retry-After": "1"})
+    except DeadlineExceeded:
+        return JSONResponse({"error": "timeout"}, status_code=503, headers={"Retry-After": "1"})
+    REQUEST_SECONDS.observe(time.perf_counter() - t0, path="/infer")
+    out = with_timings(out, pre, timings)
+    if transcript is not None:
+        out["transcript"] = transcript
+    return JSONResponse(out)
+
+@app.post("/infer/stream")
+async def infer_stream(image: UploadFile = File(...), user_query: str = Form(...), timings: bool = False):
+    t0 = time.perf_counter()
     img_bytes = await image.read()
-    out = pipe.explain(img_bytes, user_query)
-    return JSONResponse(out)
\ No newline at end of file
+    pre = StageTimer()
+    img = await backend.preprocess(img_bytes, pre)
+    try:
+        events = backend.explain_stream(img, user_query)
+    except QueueFull:
+        return JSONResponse({"error": "busy"}, status_code=429, headers={"Retry-After": "1"})
+
+    async def sse():
+        try:
+            async for kind, value in events:
+                data = {"text": value} if kind == "delta" else with_timings(value, pre, timings)
+                yield f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+            REQUEST_SECONDS.observe(time.perf_counter() - t0, path="/infer/stream")
+        except QueueFull:
+            yield f"event: error\ndata: {json.dumps({'error': 'busy'})}\n\n"
+        except DeadlineExceeded:
+            yield f"event: error\ndata: {json.dumps({'error': 'timeout'})}\n\n"
+        except NotReady:
+            yield f"event: error\ndata: {json.dumps({'error': 'loading'})}\n\n"
+
+    return StreamingResponse(sse(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/infer/batch")
+async def infer_batch(images: List[UploadFile] = File(None), archive: Optional[UploadFile] = File(None),
+                      user_query: str = Form("이게 뭐야?"), timings: bool = False):
+    # multipart 이미지 여러 장 또는 zip 하나 → NDJSON (입력 순서대로, 끝난 것부터 바로 흘려보냄)
+    # 업로드 파일은 핸들러가 돌려준 직후 닫히므로(응답 스트리밍 전) 내용은 여기서 먼저 메모리로
+    if not backend.ready:
+        raise NotReady("loading")
+    loop = asyncio.get_running_loop()
+    items: List[Dict[str, Any]] = []
+    if archive is not None:
+        try:
+            zf = zipfile.ZipFile(io.BytesIO(await archive.read()))
+            items = zip_items(zf, user_query)
+        except (zipfile.BadZipFile, ValueError, KeyError):
+            return JSONResponse({"error": "archive must be a zip of images (optionally with manifest.jsonl)"},
+                                status_code=400)
+        for it in items:
+            # 압축 해제는 항목을 처리할 차례에 (전부 풀어두지 않음)
+            it["read"] = lambda n=it["image"]: loop.run_in_executor(None, zf.read, n)
+    for f in images or []:
+        data = await f.read()
+        items.append({"id": f.filename, "image": f.filename, "query": user_query,
+                      "read": lambda d=data: asyncio.sleep(0, result=d)})
+    if not items:
+        return JSONResponse({"error": "no images"}, status_code=400)
+    if len(items) > int(BATCH_API.get("max_items", 2000)):
+        return JSONResponse({"error": "too many images"}, status_code=413)
+
+    sem = asyncio.Semaphore(int(BATCH_API.get("concurrency", 8)))
+    deadline_ms = int(BATCH_API.get("deadline_ms", 600000))
+    retries = int(BATCH_API.get("busy_retries", 20))
+
+    async def run(it: Dict[str, Any]) -> str:
+        async with sem:
+            try:
+                pre = StageTimer()
+                img = await backend.preprocess(await it["read"](), pre)
+                for attempt in range(retries + 1):
+                    try:
+                        out = await backend.explain(img, it["query"], priority=PRIORITY_BULK, deadline_ms=deadline_ms)
+                        break
+                    except QueueFull:
+                        # 대화형 요청에 밀려난 경우: 잠시 뒤 다시
+                        if attempt == retries:
+                            raise
+                        await asyncio.sleep(min(2.0, 0.05 * 2 ** attempt))
+                return result_line(it, with_timings(out, pre, timings))
+            except QueueFull:
+                return result_line(it, error="busy")
+            except DeadlineExceeded:
+                return result_line(it, error="timeout")
+            except NotReady:
+                return result_line(it, error="loading")
+            except Exception as e:
+                return result_line(it, error=repr(e))
+
+    t0 = time.perf_counter()
+    tasks = [asyncio.ensure_future(run(it)) for it in items]
+
+    async def ndjson():
+        try:
+            for t in tasks:
+                yield await t
+            REQUEST_SECONDS.observe(time.perf_counter() - t0, path="/infer/batch")
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
@@ -0,0 +1,207 @@
+# app/stt.py
+# 스트리밍 음성 인식: 16kHz PCM 조각을 webrtcvad로 발화 단위로 자르고, 발화마다 STT 엔진을 워커 풀에서 실행
+import io, asyncio, importlib, logging, threading, time, wave
+import numpy as np
+import webrtcvad
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from .metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+STT_SECONDS = REGISTRY.histogram("stt_seconds", "Speech-to-text latency per utterance")
+UTTERANCE_SECONDS = REGISTRY.histogram("stt_utterance_seconds", "Length of segmented utterances",
+                                       buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30))
+
+def resample_pcm16(pcm: bytes, src_rate: int, dst_rate: int = SAMPLE_RATE) -> bytes:
+    # 선형 보간 (음성 인식용으로 충분)
+    if src_rate == dst_rate or not pcm:
+        return pcm
+    x = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+    n = int(len(x) * dst_rate / src_rate)
+    y = np.interp(np.linspace(0, len(x) - 1, n), np.arange(len(x)), x)
+    return y.astype(np.int16).tobytes()
+
+def wav_to_pcm16k(data: bytes) -> bytes:
+    # 업로드된 WAV(PCM) → 16kHz 모노 16bit
+    with wave.open(io.BytesIO(data), "rb") as w:
+        ch, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        raw = w.readframes(w.getnframes())
+    if width == 1:
+        x = (np.frombuffer(raw, dtype=np.uint8).astype(np.int16) - 128) << 8
+    elif width == 2:
+        x = np.frombuffer(raw, dtype=np.int16)
+    elif width == 4:
+        x = (np.frombuffer(raw, dtype=np.int32) >> 16).astype(np.int16)
+    else:
+        raise ValueError(f"unsupported WAV sample width {width}")
+    if ch > 1:
+        x = x.reshape(-1, ch).mean(axis=1).astype(np.int16)
+    return resample_pcm16(x.tobytes(), rate)
+
+class VadSegmenter:
+    # 세션별 상태: feed()로 들어온 조각을 프레임 단위로 판정하고, 말이 끝난(무음이 이어진) 발화를 돌려줌
+    def __init__(self, aggressiveness: int = 2, frame_ms: int = 30, start_ms: int = 150, pre_roll_ms: int = 300,
+                 end_silence_ms: int = 600, min_speech_ms: int = 250, max_utterance_s: float = 15.0):
+        self.vad = webrtcvad.Vad(int(aggressiveness))
+        self.frame_ms = int(frame_ms)
+        self.frame_bytes = SAMPLE_RATE * self.frame_ms // 1000 * 2
+        self.start_frames = max(1, int(start_ms) // self.frame_ms)
+        self.end_frames = max(1, int(end_silence_ms) // self.frame_ms)
+        self.min_bytes = SAMPLE_RATE * int(min_speech_ms) // 1000 * 2
+        self.max_bytes = int(SAMPLE_RATE * float(max_utterance_s)) * 2
+        # 말 시작 직전 구간도 발화에 포함 (첫 음절이 잘리지 않도록)
+        self._pre: deque = deque(maxlen=max(self.start_frames, int(pre_roll_ms) // self.frame_ms))
+        self._buf = bytearray()
+        self._speech = bytearray()
+        self._in_speech = False
+        self._silence = 0
+
+    @classmethod
+    def from_cfg(cls, cfg: Dict[str, Any]) -> "VadSegmenter":
+        v = ((cfg.get("stt") or {}).get("vad") or {})
+        return cls(
+            aggressiveness=int(v.get("aggressiveness", 2)),
+            frame_ms=int(v.get("frame_ms", 30)),
+            start_ms=int(v.get("start_ms", 150)),
+            pre_roll_ms=int(v.get("pre_roll_ms", 300)),
+            end_silence_ms=int(v.get("end_silence_ms", 600)),
+            min_speech_ms=int(v.get("min_speech_ms", 250)),
+            max_utterance_s=float(v.get("max_utterance_s", 15.0)),
+        )
+
+    @property
+    def in_speech(self) -> bool:
+        return self._in_speech
+
+    def feed(self, pcm: bytes) -> List[bytes]:
+        self._buf += pcm
+        done = []
+        fb = self.frame_bytes
+        while len(self._buf) >= fb:
+            frame = bytes(self._buf[:fb])
+            del self._buf[:fb]
+            voiced = self.vad.is_speech(frame, SAMPLE_RATE)
+            if not self._in_speech:
+                self._pre.append((frame, voiced))
+                if sum(v for _, v in self._pre) >= self.start_frames:
+                    self._in_speech = True
+                    self._speech = bytearray(b"".join(f for f, _ in self._pre))
+                    self._pre.clear()
+                    self._silence = 0
+                continue
+            self._speech += frame
+            self._silence = 0 if voiced else self._silence + 1
+            if self._silence >= self.end_frames or len(self._speech) >= self.max_bytes:
+                utt = self._finish()
+                if utt is not None:
+                    done.append(utt)
+        return done
+
+    def flush(self) -> Optional[bytes]:
+        # 클라이언트가 녹음을 멈춘 경우: 진행 중인 발화를 바로 마감
+        self._buf.clear()
+        self._pre.clear()
+        return self._finish() if self._in_speech else None
+
+    def _finish(self) -> Optional[bytes]:
+        speech = bytes(self._speech)
+        self._speech = bytearray()
+        self._in_speech = False
+        self._silence = 0
+        if len(speech) < self.min_bytes:
+            return None
+        UTTERANCE_SECONDS.observe(len(speech) / 2 / SAMPLE_RATE)
+        return speech
+
+class SttEngine:
+    # 엔진 인터페이스: 16kHz 모노 16bit PCM → 텍스트 (워커 스레드에서 호출됨)
+    def transcribe(self, pcm: bytes, lang: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+class NullEngine(SttEngine):
+    def transcribe(self, pcm: bytes, lang: Optional[str] = None) -> str:
+        return ""
+
+class FasterWhisperEngine(SttEngine):
+    def __init__(self, model: str = "small", device: str = "auto", compute_type: str = "int8", workers: int = 1,
+                 beam_size: int = 1):
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(model, device=device, compute_type=compute_type, num_workers=max(1, workers))
+        self.beam_size = int(beam_size)
+
+    def transcribe(self, pcm: bytes, lang: Optional[str] = None) -> str:
+        audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        # 발화 단위는 이미 VAD로 잘렸으므로 엔진 쪽 VAD는 끔
+        segments, _ = self.model.transcribe(audio, language=lang, beam_size=self.beam_size, vad_filter=False)
+        return "".join(s.text for s in segments).strip()
+
+def load_engine(s: Dict[str, Any]) -> SttEngine:
+    name = str(s.get("engine", "none"))
+    if name == "none":
+        return NullEngine()
+    if name == "faster_whisper":
+        return FasterWhisperEngine(
+            model=s.get("model", "small"),
+            device=s.get("device", "auto"),
+            compute_type=s.get("compute_type", "int8"),
+            workers=int(s.get("workers", 2)),
+            beam_size=int(s.get("beam_size", 1)),
+        )
+    # "패키지.모듈:클래스" 형태의 사용자 엔진 (stt.options를 생성자 인자로 전달)
+    module, _, attr = name.partition(":")
+    return getattr(importlib.import_module(module), attr)(**(s.get("options") or {}))
+
+class SpeechToText:
+    # 발화 인식은 전용 풀에서: 이벤트 루프와 프레임 소비자는 절대 기다리지 않음
+    # 엔진(가중치 다운로드/로드)은 import 시점이 아니라 start()에서 백그라운드로 올림
+    def __init__(self, spec: Dict[str, Any], workers: int = 2, lang: Optional[str] = None):
+        self.spec = spec
+        self.lang = lang
+        self.engine: Optional[SttEngine] = None
+        self.state = "idle"
+        self.error: Optional[str] = None
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="stt")
+
+    @classmethod
+    def from_cfg(cls, cfg: Dict[str, Any]) -> Optional["SpeechToText"]:
+        s = (cfg.get("stt") or {})
+        if not s.get("enabled", True):
+            return None
+        return cls(s, workers=int(s.get("workers", 2)), lang=s.get("lang") or cfg.get("lang"))
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def start(self):
+        if self.state == "idle":
+            self.state = "loading"
+            threading.Thread(target=self.load, name="stt-load", daemon=True).start()
+
+    def load(self):
+        self.state = "loading"
+        try:
+            self.engine = load_engine(self.spec)
+            self.state = "ready"
+        except Exception as e:
+            # 패키지 없음, 다운로드 실패 등: 서버는 그대로 두고 음성 질문만 끔
+            log.warning("STT engine %r unavailable (%r); voice queries are disabled", self.spec.get("engine"), e)
+            self.error = repr(e)
+            self.state = "failed"
+
+    def _run(self, pcm: bytes) -> str:
+        t0 = time.perf_counter()
+        text = self.engine.transcribe(pcm, self.lang)
+        STT_SECONDS.observe(time.perf_counter() - t0)
+        return text
+
+    async def transcribe(self, pcm: bytes) -> str:
+        return await asyncio.get_running_loop().run_in_executor(self.pool, self._run, pcm)
+
+    async def transcribe_wav(self, data: bytes) -> str:
+        # 업로드 파일 한 개 = 발화 한 개 (디코딩/리샘플도 풀에서)
+        return await asyncio.get_running_loop().run_in_executor(self.pool, lambda: self._run(wav_to_pcm16k(data)))
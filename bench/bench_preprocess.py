@@ -0,0 +1,59 @@
+# bench/bench_preprocess.py
+# 이미지 전처리 마이크로 벤치마크: 기존 PIL 전체 디코딩 + LANCZOS vs app.preprocess.load_image
+# 실행: python -m bench.bench_preprocess [--max-side 896] [--repeat 20]
+import argparse, io, time
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.preprocess import load_image
+
+# 자주 들어오는 업로드 크기 (웹캠 프레임 ~ 휴대폰 원본)
+SIZES = [(640, 480), (1280, 720), (1920, 1080), (3024, 4032), (4000, 3000)]
+
+def make_image(w: int, h: int, fmt: str) -> bytes:
+    # 그라디언트 + 노이즈: 실제 사진과 비슷한 압축률이 나오도록
+    yy, xx = np.mgrid[0:h, 0:w]
+    base = np.stack([xx * 255 // max(1, w - 1), yy * 255 // max(1, h - 1), (xx + yy) % 256], axis=-1)
+    noise = np.random.default_rng(0).integers(0, 32, size=(h, w, 3))
+    arr = np.clip(base + noise, 0, 255).astype(np.uint8)
+    ext = {"jpeg": ".jpg", "png": ".png", "webp": ".webp"}[fmt]
+    ok, enc = cv2.imencode(ext, arr)
+    assert ok
+    return enc.tobytes()
+
+def legacy(img_bytes: bytes, max_side: int) -> np.ndarray:
+    # 기존 Explainer._resize 경로
+    img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
+    w, h = img.size
+    scale = max_side / max(w, h)
+    if scale < 1.0:
+        img = img.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.LANCZOS)
+    return np.asarray(img)
+
+def timeit(fn, repeat: int) -> float:
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) * 1000.0 / repeat
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--max-side", type=int, default=896)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--formats", default="jpeg,png,webp")
+    args = ap.parse_args()
+
+    print(f"{'format':<6} {'size':>11} {'KB':>7} {'legacy ms':>10} {'fast ms':>8} {'speedup':>8} {'out':>10}")
+    for fmt in args.formats.split(","):
+        for w, h in SIZES:
+            data = make_image(w, h, fmt)
+            t_old = timeit(lambda: legacy(data, args.max_side), args.repeat)
+            t_new = timeit(lambda: load_image(data, args.max_side), args.repeat)
+            out = load_image(data, args.max_side)
+            print(f"{fmt:<6} {f'{w}x{h}':>11} {len(data) // 1024:>7} {t_old:>10.2f} {t_new:>8.2f} "
+                  f"{t_old / t_new:>7.1f}x {f'{out.shape[1]}x{out.shape[0]}':>10}")
+
+if __name__ == "__main__":
+    main()
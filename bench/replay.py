@@ -0,0 +1,333 @@
+# bench/replay.py
+# 기록된 코퍼스(이미지 + 질문)를 재생해서 처리량, p50/p95/p99 지연, TTFT, tokens/s를 측정
+#
+# 모드
+#   http   : app.server 의 /infer/stream(SSE)에 동시 요청 (TTFT 측정을 위해 스트리밍 엔드포인트 사용)
+#   ws     : app.rt_server 의 /ws 에 여러 세션이 바이너리 프레임을 fps로 전송
+#   inproc : Explainer + InferenceScheduler 를 프로세스 안에서 직접 구동 (--tiny: 오프라인 초소형 대역 모델)
+#
+# 코퍼스: JSONL 한 줄에 {"image": "경로", "query": "질문"} (경로는 코퍼스 파일 기준 상대경로 가능)
+#         --corpus 를 주지 않으면 합성 이미지 + 기본 질문 사용
+#
+# 실행 예
+#   python -m bench.replay inproc --tiny --requests 32 --concurrency 4
+#   python -m bench.replay inproc --tiny --set prefix_cache.enabled=false --json-out nocache.json --baseline base.json
+#   (HF generate() 경로와 비교하려면 --set vision_cache.enabled=false 도 함께)
+#   python -m bench.replay http --url http://localhost:8000 --corpus corpus.jsonl --concurrency 8
+#   python -m bench.replay ws --url ws://localhost:9000/ws --sessions 4 --fps 2 --duration 30
+import argparse, asyncio, json, math, os, struct, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+DEFAULT_QUERIES = ["이게 뭐야?", "정확한 모델명이 뭐야?", "What am I holding?", "What's the exact model name?"]
+FRAME_HEADER = struct.Struct(">IdI")
+
+@dataclass
+class Sample:
+    ok: bool
+    latency_s: float = 0.0
+    ttft_s: Optional[float] = None
+    tokens: Optional[int] = None
+    cached: bool = False
+    error: str = ""
+
+def load_corpus(path: Optional[str], synthetic: int) -> List[Tuple[bytes, str]]:
+    if path:
+        base = os.path.dirname(os.path.abspath(path))
+        items = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                obj = json.loads(line)
+                img_path = obj["image"] if os.path.isabs(obj["image"]) else os.path.join(base, obj["image"])
+                with open(img_path, "rb") as img:
+                    items.append((img.read(), obj.get("query") or DEFAULT_QUERIES[0]))
+        return items
+
+    from .bench_preprocess import make_image
+    sizes = [(640, 480), (1280, 720), (1920, 1080), (3024, 4032)]
+    return [
+        (make_image(*sizes[i % len(sizes)], "jpeg"), DEFAULT_QUERIES[i % len(DEFAULT_QUERIES)])
+        for i in range(max(1, synthetic))
+    ]
+
+def pct(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    # nearest-rank
+    k = max(0, min(len(values) - 1, math.ceil(p / 100.0 * len(values)) - 1))
+    return values[k]
+
+def dist_ms(values: List[float]) -> Dict[str, Optional[float]]:
+    ms = [v * 1000.0 for v in values]
+    return {
+        "p50": pct(ms, 50), "p95": pct(ms, 95), "p99": pct(ms, 99),
+        "mean": (sum(ms) / len(ms)) if ms else None,
+    }
+
+def summarize(samples: List[Sample], wall_s: float) -> Dict[str, Any]:
+    ok = [s for s in samples if s.ok]
+    tps = [
+        s.tokens / (s.latency_s - s.ttft_s)
+        for s in ok
+        if s.tokens and s.ttft_s is not None and s.latency_s > s.ttft_s
+    ]
+    errors: Dict[str, int] = {}
+    for s in samples:
+        if not s.ok:
+            errors[s.error] = errors.get(s.error, 0) + 1
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": errors,
+        "cached": sum(1 for s in ok if s.cached),
+        "wall_s": round(wall_s, 3),
+        "throughput_rps": round(len(ok) / wall_s, 3) if wall_s > 0 else None,
+        "latency_ms": dist_ms([s.latency_s for s in ok]),
+        "ttft_ms": dist_ms([s.ttft_s for s in ok if s.ttft_s is not None]),
+        "tokens_per_s": round(sum(tps) / len(tps), 2) if tps else None,
+    }
+
+# ---------------- http ----------------
+
+def run_http(args, corpus: List[Tuple[bytes, str]]) -> Dict[str, Any]:
+    import requests
+
+    url = args.url.rstrip("/") + "/infer/stream"
+
+    def one(i: int) -> Sample:
+        img, query = corpus[i % len(corpus)]
+        t0 = time.perf_counter()
+        ttft = None
+        try:
+            with requests.post(url, files={"image": ("frame.jpg", img, "image/jpeg")},
+                               data={"user_query": query}, stream=True, timeout=args.timeout) as r:
+                if r.status_code != 200:
+                    return Sample(ok=False, error=f"http_{r.status_code}")
+                event = None
+                for line in r.iter_lines(decode_unicode=True):
+                    if line.startswith("event:"):
+                        event = line.split(":", 1)[1].strip()
+                    elif line.startswith("data:"):
+                        data = json.loads(line.split(":", 1)[1])
+                        if event == "delta" and ttft is None:
+                            ttft = time.perf_counter() - t0
+                        elif event == "result":
+                            return Sample(ok=True, latency_s=time.perf_counter() - t0, ttft_s=ttft,
+                                          tokens=data.get("tokens"))
+                        elif event == "error":
+                            return Sample(ok=False, error=data.get("error", "error"))
+        except Exception as e:
+            return Sample(ok=False, error=type(e).__name__)
+        return Sample(ok=False, error="no_result")
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        samples = list(ex.map(one, range(args.requests)))
+    return summarize(samples, time.perf_counter() - t0)
+
+# ---------------- ws ----------------
+
+async def ws_session(args, corpus: List[Tuple[bytes, str]], sid: int, samples: List[Sample], sent: List[int]):
+    import websockets
+
+    interval = 1.0 / args.fps
+    stop_at = time.time() + args.duration
+    capture: Dict[int, float] = {}
+    first_delta: Dict[int, float] = {}
+
+    async with websockets.connect(args.url, max_size=None) as ws:
+        query = corpus[sid % len(corpus)][1]
+        await ws.send(json.dumps({"type": "text", "user_query": query}, ensure_ascii=False))
+
+        async def sender():
+            seq = 0
+            while time.time() < stop_at:
+                img = corpus[(sid + seq) % len(corpus)][0] if args.cycle else corpus[sid % len(corpus)][0]
+                ts = time.time() * 1000.0
+                capture[seq] = ts
+                await ws.send(FRAME_HEADER.pack(seq, ts, 0) + img)
+                sent[0] += 1
+                seq += 1
+                await asyncio.sleep(interval)
+
+        async def receiver():
+            while True:
+                msg = json.loads(await ws.recv())
+                now = time.time() * 1000.0
+                seq = msg.get("seq")
+                if msg.get("type") == "delta":
+                    first_delta.setdefault(seq, now)
+                elif msg.get("type") == "result" and seq in capture:
+                    ts = capture[seq]
+                    ttft = (first_delta[seq] - ts) / 1000.0 if seq in first_delta else None
+                    samples.append(Sample(ok=True, latency_s=(now - ts) / 1000.0, ttft_s=ttft,
+                                          tokens=msg.get("tokens"), cached=bool(msg.get("cached"))))
+
+        recv_task = asyncio.create_task(receiver())
+        await sender()
+        # 마지막 프레임 결과를 잠깐 기다림
+        await asyncio.sleep(args.drain_s)
+        recv_task.cancel()
+
+async def run_ws_async(args, corpus):
+    samples: List[Sample] = []
+    sent = [0]
+    t0 = time.perf_counter()
+    await asyncio.gather(*[ws_session(args, corpus, i, samples, sent) for i in range(args.sessions)],
+                         return_exceptions=True)
+    out = summarize(samples, time.perf_counter() - t0)
+    out["frames_sent"] = sent[0]
+    return out
+
+def run_ws(args, corpus):
+    return asyncio.run(run_ws_async(args, corpus))
+
+# ---------------- inproc ----------------
+
+def set_dotted(cfg: Dict[str, Any], dotted: str):
+    key, value = dotted.split("=", 1)
+    node = cfg
+    parts = key.split(".")
+    for p in parts[:-1]:
+        node = node.setdefault(p, {})
+    node[parts[-1]] = yaml.safe_load(value)
+
+def make_inproc_cfg(args) -> str:
+    with open(args.config, "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    if args.tiny:
+        from .tiny_model import build_tiny_checkpoint
+        cfg["qwen_model"] = build_tiny_checkpoint(args.tiny_dir)
+        cfg["device"] = "cpu"
+    if args.max_new_tokens:
+        cfg.setdefault("gen", {})["max_new_tokens"] = args.max_new_tokens
+    for item in args.set or []:
+        set_dotted(cfg, item)
+    fd, path = tempfile.mkstemp(suffix=".yml", prefix="bench-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        yaml.safe_dump(cfg, f, allow_unicode=True)
+    return path
+
+async def run_inproc_async(args, corpus, pipe, sched) -> Dict[str, Any]:
+    from app.scheduler import QueueFull, DeadlineExceeded
+
+    loop = asyncio.get_running_loop()
+    counter = iter(range(args.requests))
+    samples: List[Sample] = []
+
+    async def worker():
+        for i in counter:
+            img_bytes, query = corpus[i % len(corpus)]
+            t0 = time.perf_counter()
+            ttft = None
+            try:
+                img = await loop.run_in_executor(pipe.decode_pool, pipe.preprocess, img_bytes)
+                if args.stream:
+                    out = None
+                    async for kind, value in sched.submit_stream(pipe.explain, img, query):
+                        if kind == "delta" and ttft is None:
+                            ttft = time.perf_counter() - t0
+                        elif kind == "result":
+                            out = value
+                else:
+                    out = await sched.submit_batched(pipe.explain_batch, (img, query))
+                samples.append(Sample(ok=True, latency_s=time.perf_counter() - t0, ttft_s=ttft,
+                                      tokens=out.get("tokens")))
+            except (QueueFull, DeadlineExceeded) as e:
+                samples.append(Sample(ok=False, error=type(e).__name__))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    return summarize(samples, time.perf_counter() - t0)
+
+def run_inproc(args, corpus):
+    from app.pipeline import Explainer
+    from app.scheduler import InferenceScheduler
+
+    cfg_path = make_inproc_cfg(args)
+    try:
+        t0 = time.perf_counter()
+        pipe = Explainer(cfg_path=cfg_path)
+        load_s = time.perf_counter() - t0
+    finally:
+        os.unlink(cfg_path)
+    sched = InferenceScheduler.from_cfg(pipe.cfg)
+
+    # 워밍업 1회 (측정에서 제외)
+    pipe.explain(corpus[0][0], corpus[0][1])
+    out = asyncio.run(run_inproc_async(args, corpus, pipe, sched))
+    out["model"] = pipe.model_id
+    out["load_s"] = round(load_s, 2)
+    return out
+
+# ---------------- report ----------------
+
+COMPARE_KEYS = [
+    ("throughput_rps", None), ("latency_ms", "p50"), ("latency_ms", "p95"), ("latency_ms", "p99"),
+    ("ttft_ms", "p50"), ("tokens_per_s", None),
+]
+
+def compare(cur: Dict[str, Any], base: Dict[str, Any]):
+    print("\nvs baseline")
+    for key, sub in COMPARE_KEYS:
+        a = cur.get(key) if sub is None else (cur.get(key) or {}).get(sub)
+        b = base.get(key) if sub is None else (base.get(key) or {}).get(sub)
+        name = key if sub is None else f"{key}.{sub}"
+        if a is None or b is None or b == 0:
+            print(f"  {name:<20} {a!s:>10} (baseline {b!s})")
+            continue
+        print(f"  {name:<20} {a:>10.2f}  baseline {b:>10.2f}  {100.0 * (a - b) / b:+6.1f}%")
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay benchmark for /infer, /ws and in-process Explainer")
+    ap.add_argument("mode", choices=["http", "ws", "inproc"])
+    ap.add_argument("--corpus", help="JSONL with {image, query} per line (default: synthetic images)")
+    ap.add_argument("--synthetic", type=int, default=8, help="number of synthetic samples without --corpus")
+    ap.add_argument("--requests", type=int, default=32)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--timeout", type=float, default=180.0)
+    ap.add_argument("--url", default=None)
+    # ws
+    ap.add_argument("--sessions", type=int, default=2)
+    ap.add_argument("--fps", type=float, default=2.0)
+    ap.add_argument("--duration", type=float, default=20.0)
+    ap.add_argument("--drain-s", type=float, default=3.0)
+    ap.add_argument("--cycle", action="store_true", help="ws: cycle corpus images instead of a static scene")
+    # inproc
+    ap.add_argument("--config", default="config.yml")
+    ap.add_argument("--tiny", action="store_true", help="inproc: use an offline random tiny Qwen2-VL")
+    ap.add_argument("--tiny-dir", default=os.path.join(tempfile.gettempdir(), "tiny-qwen2vl"))
+    ap.add_argument("--max-new-tokens", type=int, default=None)
+    ap.add_argument("--stream", action="store_true", help="inproc: use the streaming path (measures TTFT)")
+    ap.add_argument("--set", action="append", help="inproc: override config, e.g. prefix_cache.enabled=false")
+    # report
+    ap.add_argument("--json-out")
+    ap.add_argument("--baseline")
+    args = ap.parse_args()
+
+    if args.url is None:
+        args.url = {"http": "http://localhost:8000", "ws": "ws://localhost:9000/ws"}.get(args.mode)
+
+    corpus = load_corpus(args.corpus, args.synthetic)
+    runner = {"http": run_http, "ws": run_ws, "inproc": run_inproc}[args.mode]
+    result = runner(args, corpus)
+    result["mode"] = args.mode
+    result["concurrency"] = args.concurrency if args.mode != "ws" else args.sessions
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+if __name__ == "__main__":
+    main()
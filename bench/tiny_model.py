@@ -0,0 +1,120 @@
+# bench/tiny_model.py
+# 네트워크 없이 CPU에서 돌릴 수 있는 초소형 Qwen2-VL 대역(랜덤 가중치) 체크포인트 생성
+# 출력 품질은 의미 없음 — 전처리/프롬프트/생성 루프/스케줄러 경로의 회귀 측정용
+# 실행: python -m bench.tiny_model /tmp/tiny-qwen2vl
+import os, shutil, sys, tempfile
+
+SPECIAL_TOKENS = [
+    "<|endoftext|>", "<|im_start|>", "<|im_end|>",
+    "<|vision_start|>", "<|vision_end|>", "<|image_pad|>", "<|video_pad|>",
+]
+
+# Qwen2-VL 템플릿을 단순화 (시스템 → 사용자[이미지, 텍스트] → assistant)
+CHAT_TEMPLATE = (
+    "{% for message in messages %}<|im_start|>{{ message['role'] }}\n"
+    "{% if message['content'] is string %}{{ message['content'] }}"
+    "{% else %}{% for c in message['content'] %}"
+    "{% if c['type'] == 'image' %}<|vision_start|><|image_pad|><|vision_end|>"
+    "{% elif c['type'] == 'text' %}{{ c['text'] }}{% endif %}"
+    "{% endfor %}{% endif %}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+
+# 이 파일들이 모두 있어야 완성된 체크포인트로 봄
+CHECKPOINT_FILES = ("config.json", "model.safetensors", "preprocessor_config.json", "tokenizer.json")
+
+def build_tokenizer():
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import Qwen2TokenizerFast
+
+    # 바이트 단위 BPE(병합 없음): 어떤 한국어/영어 문장도 UNK 없이 토큰화됨
+    alphabet = sorted(pre_tokenizers.ByteLevel.alphabet())
+    tok = Tokenizer(models.BPE(vocab={ch: i for i, ch in enumerate(alphabet)}, merges=[]))
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+
+    # Qwen2VLProcessor는 Qwen2Tokenizer(Fast) 타입만 받음
+    fast = Qwen2TokenizerFast(
+        tokenizer_object=tok,
+        unk_token=None,
+        eos_token="<|im_end|>",
+        pad_token="<|endoftext|>",
+        additional_special_tokens=SPECIAL_TOKENS,
+    )
+    fast.chat_template = CHAT_TEMPLATE
+    return fast
+
+def build_tiny_checkpoint(out_dir: str, max_pixels: int = 64 * 28 * 28) -> str:
+    if all(os.path.exists(os.path.join(out_dir, f)) for f in CHECKPOINT_FILES):
+        return out_dir
+    if os.path.isdir(out_dir) and os.listdir(out_dir) and not os.path.exists(os.path.join(out_dir, "config.json")):
+        raise RuntimeError(f"{out_dir} is not empty and is not a tiny checkpoint")
+    # 임시 디렉터리에 다 쓴 뒤 옮김: 중간에 실패해도 반쯤 쓴 체크포인트가 남지 않음
+    parent = os.path.dirname(os.path.abspath(out_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".tiny-", dir=parent)
+    try:
+        _write_checkpoint(tmp_dir, max_pixels)
+        # 이전 실패로 남은 불완전한 디렉터리는 교체
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.replace(tmp_dir, out_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return out_dir
+
+def _write_checkpoint(out_dir: str, max_pixels: int):
+    import torch
+    from transformers import (
+        Qwen2VLConfig, Qwen2VLForConditionalGeneration, Qwen2VLImageProcessor, Qwen2VLProcessor,
+    )
+
+    torch.manual_seed(0)
+
+    tokenizer = build_tokenizer()
+    ids = {t: tokenizer.convert_tokens_to_ids(t) for t in SPECIAL_TOKENS}
+    hidden = 64
+
+    config = Qwen2VLConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=8192,
+        # head_dim 16 → rotary 절반 8 = 2 + 3 + 3
+        rope_scaling={"type": "mrope", "mrope_section": [2, 3, 3]},
+        tie_word_embeddings=True,
+        bos_token_id=ids["<|endoftext|>"],
+        eos_token_id=ids["<|im_end|>"],
+        pad_token_id=ids["<|endoftext|>"],
+        image_token_id=ids["<|image_pad|>"],
+        video_token_id=ids["<|video_pad|>"],
+        vision_start_token_id=ids["<|vision_start|>"],
+        vision_end_token_id=ids["<|vision_end|>"],
+        vision_config={
+            "depth": 1,
+            "embed_dim": 32,
+            "hidden_size": hidden,
+            "num_heads": 2,
+            "mlp_ratio": 2,
+            "in_channels": 3,
+            "patch_size": 14,
+            "spatial_merge_size": 2,
+            "temporal_patch_size": 2,
+        },
+    )
+    model = Qwen2VLForConditionalGeneration(config).eval()
+    model.generation_config.eos_token_id = [ids["<|im_end|>"], ids["<|endoftext|>"]]
+    model.generation_config.pad_token_id = ids["<|endoftext|>"]
+    model.save_pretrained(out_dir, safe_serialization=True)
+
+    image_processor = Qwen2VLImageProcessor(
+        min_pixels=4 * 28 * 28, max_pixels=max_pixels,
+        patch_size=14, merge_size=2, temporal_patch_size=2,
+    )
+    processor = Qwen2VLProcessor(image_processor=image_processor, tokenizer=tokenizer, chat_template=CHAT_TEMPLATE)
+    processor.save_pretrained(out_dir)
+
+if __name__ == "__main__":
+    print(build_tiny_checkpoint(sys.argv[1] if len(sys.argv) > 1 else "/tmp/tiny-qwen2vl"))
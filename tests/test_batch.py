@@ -0,0 +1,46 @@
+# tests/test_batch.py
+import io, json, os, zipfile
+from app.batch import dir_items, load_done, parse_manifest, result_line, zip_items
+
+def write(path, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+def test_load_done_skips_results_and_retries_errors(tmp_path):
+    out = tmp_path / "results.jsonl"
+    a, b, c = ({"id": i, "query": "q"} for i in ("a", "b", "c"))
+    out.write_text(result_line(a, {"explanation": "컵"}) + result_line(b, error="RuntimeError('oom')") +
+                   result_line(c, {"explanation": "책"}), encoding="utf-8")
+    assert load_done(str(out)) == {"a", "c"}
+
+def test_load_done_truncates_a_torn_last_line(tmp_path):
+    out = tmp_path / "results.jsonl"
+    good = result_line({"id": "a", "query": "q"}, {"explanation": "컵"})
+    out.write_bytes(good.encode("utf-8") + b'{"id": "b", "expl')
+    assert load_done(str(out)) == {"a"}
+    assert out.read_bytes() == good.encode("utf-8")
+    assert load_done(str(tmp_path / "missing.jsonl")) == set()
+
+def test_dir_items_are_sorted_and_skip_non_images(tmp_path):
+    for name in ("b/2.jpg", "b/1.png", "a.JPG", ".hidden.jpg", "notes.txt"):
+        write(str(tmp_path / name), b"x")
+    items = dir_items(str(tmp_path), "q")
+    assert [it["id"] for it in items] == ["a.JPG", os.path.join("b", "1.png"), os.path.join("b", "2.jpg")]
+
+def test_manifest_defaults_id_and_query():
+    lines = ['{"image": "x.jpg"}', "", '{"image": "y.jpg", "query": "색깔은?", "id": 7}']
+    assert parse_manifest(lines, "기본") == [
+        {"id": "x.jpg", "image": "x.jpg", "query": "기본"},
+        {"id": "7", "image": "y.jpg", "query": "색깔은?"},
+    ]
+
+def test_zip_items_prefer_the_manifest():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("b.jpg", b"x")
+        zf.writestr("a.jpg", b"x")
+    assert [it["id"] for it in zip_items(zipfile.ZipFile(buf), "q")] == ["a.jpg", "b.jpg"]
+    with zipfile.ZipFile(buf, "a") as zf:
+        zf.writestr("manifest.jsonl", json.dumps({"image": "b.jpg", "query": "뭐야?"}) + "\n")
+    assert zip_items(zipfile.ZipFile(buf), "q") == [{"id": "b.jpg", "image": "b.jpg", "query": "뭐야?"}]
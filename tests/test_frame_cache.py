@@ -0,0 +1,57 @@
+# tests/test_frame_cache.py
+import io
+import numpy as np
+from PIL import Image
+from app import frame_cache as fc
+from app.frame_cache import FrameAnswerCache, dhash, normalize_query
+
+def jpeg(arr: np.ndarray, quality: int = 90) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(arr).save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+def scene(seed: int) -> np.ndarray:
+    yy, xx = np.mgrid[0:240, 0:320]
+    rng = np.random.default_rng(seed)
+    a, b = rng.uniform(-1, 1, 2)
+    base = (xx * a + yy * b) % 256
+    return np.stack([base, base[::-1], (xx + yy) % 256], axis=-1).astype(np.uint8)
+
+def test_dhash_tolerates_recompression_but_not_a_new_scene():
+    img = scene(0)
+    h1, h2 = dhash(jpeg(img, 95)), dhash(jpeg(img, 60))
+    assert bin(h1 ^ h2).count("1") <= 6
+    assert bin(h1 ^ dhash(jpeg(scene(1)))).count("1") > 6
+
+def test_normalize_query():
+    assert normalize_query("  이게 뭐야?? ") == "이게 뭐야"
+    assert normalize_query("What IS this!") == "what is this"
+
+def test_hit_needs_same_query_and_near_hash():
+    cache = FrameAnswerCache(max_distance=2)
+    cache.put(0b1111, "이게 뭐야?", {"explanation": "컵"})
+    assert cache.get(0b1110, "이게 뭐야") == {"explanation": "컵"}
+    assert cache.get(0b1111, "색깔은?") is None
+    assert cache.get(0b0000, "이게 뭐야?") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(fc.time, "monotonic", lambda: now[0])
+    cache = FrameAnswerCache(ttl_s=30)
+    cache.put(1, "q", {"explanation": "a"})
+    now[0] += 29
+    assert cache.get(1, "q") is not None
+    now[0] += 2
+    assert cache.get(1, "q") is None
+    assert cache.stats()["size"] == 0
+
+def test_lru_keeps_max_entries():
+    cache = FrameAnswerCache(max_entries=2, max_distance=0)
+    cache.put(1, "q", {"n": 1})
+    cache.put(2, "q", {"n": 2})
+    assert cache.get(1, "q") == {"n": 1}
+    cache.put(3, "q", {"n": 3})
+    assert cache.get(2, "q") is None
+    assert cache.get(1, "q") == {"n": 1}
+    assert cache.get(3, "q") == {"n": 3}
@@ -0,0 +1,19 @@
+# tests/test_health.py
+from fastapi.testclient import TestClient
+from app import server
+
+def test_health_is_liveness_while_the_model_loads():
+    # lifespan을 돌리지 않으므로 백엔드는 로드 전 상태 그대로
+    client = TestClient(server.app)
+    assert not server.backend.ready
+    assert client.get("/health").status_code == 200
+    assert client.get("/health/live").status_code == 200
+    r = client.get("/health/ready")
+    assert r.status_code == 503
+    assert r.json()["ok"] is False
+
+def test_batch_is_rejected_while_the_model_loads():
+    client = TestClient(server.app)
+    r = client.post("/infer/batch", files=[("images", ("a.jpg", b"x", "image/jpeg"))])
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "5"
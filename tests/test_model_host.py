@@ -0,0 +1,129 @@
+# tests/test_model_host.py
+import asyncio, os, tempfile
+import numpy as np
+import pytest
+from app.model_host import HostClient, parse_cpus, put_image, recv_msg, send_msg, serve, take_image
+
+class FakeSched:
+    stats = {"running": 0}
+
+    def qsize(self) -> int:
+        return 0
+
+class FakeBackend:
+    # explain은 풀어 줄 때까지 대기, 취소/해제된 요청을 기록
+    def __init__(self):
+        self.sched = FakeSched()
+        self.started = []
+        self.gate = asyncio.Event()
+        self.cancelled = []
+        self.released = []
+
+    async def explain(self, img, query, session=None, **opts):
+        self.started.append(query)
+        try:
+            await self.gate.wait()
+        except asyncio.CancelledError:
+            self.cancelled.append(query)
+            raise
+        return {"explanation": query, "shape": list(img.shape)}
+
+    async def release(self, session):
+        self.released.append(session)
+
+async def wait_for(cond, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        if cond():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+def run_host(test):
+    # 임시 유닉스 소켓에 호스트를 띄우고 test(client, backend) 실행
+    async def main():
+        backend = FakeBackend()
+        path = os.path.join(tempfile.mkdtemp(), "host.sock")
+        server = asyncio.ensure_future(serve(backend, path))
+        await wait_for(lambda: os.path.exists(path))
+        client = HostClient(path)
+        try:
+            await test(client, backend)
+        finally:
+            server.cancel()
+    asyncio.run(main())
+
+async def collect(client, query, **fields):
+    img = np.zeros((2, 3, 3), dtype=np.uint8)
+    return [msg async for msg in client.request("explain", img, query, **fields)]
+
+def test_message_framing_round_trip():
+    async def main():
+        reader = asyncio.StreamReader()
+        writes = []
+
+        class Writer:
+            def write(self, data):
+                writes.append(data)
+
+            async def drain(self):
+                pass
+
+        await send_msg(Writer(), {"op": "explain", "query": "이게 뭐야?"})
+        await send_msg(Writer(), {"id": 1})
+        reader.feed_data(b"".join(writes))
+        assert await recv_msg(reader) == {"op": "explain", "query": "이게 뭐야?"}
+        assert await recv_msg(reader) == {"id": 1}
+        # 메시지 중간에 끊기면 None
+        reader.feed_data(writes[0][:6])
+        reader.feed_eof()
+        assert await recv_msg(reader) is None
+    asyncio.run(main())
+
+def test_parse_cpus():
+    assert parse_cpus(None) == set()
+    assert parse_cpus("") == set()
+    assert parse_cpus(3) == {3}
+    assert parse_cpus([0, "2"]) == {0, 2}
+    assert parse_cpus("0-2, 8") == {0, 1, 2, 8}
+
+def test_shared_memory_image_round_trip():
+    img = np.arange(2 * 3 * 3, dtype=np.uint8).reshape(2, 3, 3)
+    shm = put_image(img)
+    try:
+        out = take_image(shm.name, img.shape)
+    finally:
+        shm.close()
+        shm.unlink()
+    assert np.array_equal(out, img)
+
+def test_request_returns_the_host_result():
+    async def test(client, backend):
+        backend.gate.set()
+        msgs = await collect(client, "컵")
+        assert [m["type"] for m in msgs] == ["result"]
+        assert msgs[0]["data"] == {"explanation": "컵", "shape": [2, 3, 3]}
+    run_host(test)
+
+def test_cancelled_request_is_cancelled_on_the_host():
+    async def test(client, backend):
+        req = asyncio.ensure_future(collect(client, "떠난 요청"))
+        await wait_for(lambda: backend.started)
+        req.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await req
+        await wait_for(lambda: backend.cancelled == ["떠난 요청"])
+        assert client.inflight == 0
+    run_host(test)
+
+def test_release_cancels_the_sessions_pending_requests():
+    async def test(client, backend):
+        mine = asyncio.ensure_future(collect(client, "내 후속 질문", session="s1"))
+        other = asyncio.ensure_future(collect(client, "다른 세션", session="s2"))
+        await wait_for(lambda: len(backend.started) == 2)
+        await client.release("s1")
+        await wait_for(lambda: backend.released == ["s1"])
+        assert backend.cancelled == ["내 후속 질문"]
+        backend.gate.set()
+        assert (await other)[0]["data"]["explanation"] == "다른 세션"
+        mine.cancel()
+    run_host(test)
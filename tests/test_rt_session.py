@@ -0,0 +1,125 @@
+# tests/test_rt_session.py
+import base64, json, threading
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from app import rt_server
+from app.frame_cache import FrameAnswerCache
+from app.scene import SceneGate
+
+class FakeBackend:
+    ready = True
+
+    def __init__(self):
+        self.released = []
+        self.done = threading.Event()
+        # (질문, 세션, new_scene) 또는 ("release", 세션) 순서대로
+        self.log = []
+
+    def stats(self):
+        return {}
+
+    async def preprocess(self, img_bytes, timer=None):
+        return img_bytes
+
+    async def explain_stream(self, img, query, session=None, new_scene=True, **opts):
+        self.log.append((query, session, new_scene))
+        yield "result", {"explanation": f"{query}@{len(self.log)}", "tokens": 1}
+
+    async def release(self, session: str):
+        self.released.append(session)
+        self.log.append(("release", session))
+        self.done.set()
+
+@pytest.fixture
+def backend(monkeypatch):
+    fake = FakeBackend()
+    monkeypatch.setattr(rt_server, "backend", fake)
+    monkeypatch.setattr(rt_server, "frame_cache", FrameAnswerCache())
+    monkeypatch.setattr(rt_server, "RT_STREAM", True)
+    monkeypatch.setattr(rt_server, "SESSIONS", True)
+    return fake
+
+def frame_msg(vertical: bool) -> str:
+    yy, xx = np.mgrid[0:240, 0:320]
+    g = (yy if vertical else xx) % 256
+    ok, buf = cv2.imencode(".jpg", g.astype(np.uint8)[..., None].repeat(3, axis=-1))
+    return json.dumps({"type": "frame", "image": "data:image/jpeg;base64," + base64.b64encode(buf.tobytes()).decode()})
+
+def text_msg(query: str) -> str:
+    return json.dumps({"type": "text", "user_query": query})
+
+def result(ws):
+    while True:
+        msg = json.loads(ws.receive_text())
+        if msg["type"] == "result":
+            return msg
+
+def test_disconnect_releases_the_session(backend):
+    # 프레임 없이 끊으면 소비자는 q.get()에서 기다리는 중: 그래도 세션은 정리돼야 함
+    client = TestClient(rt_server.app)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_text(json.dumps({"type": "text", "user_query": "이게 뭐야?"}))
+        ws.close()
+        assert backend.done.wait(5)
+    assert len(backend.released) == 1
+
+def test_each_connection_gets_its_own_session(backend):
+    client = TestClient(rt_server.app)
+    for _ in range(2):
+        backend.done.clear()
+        with client.websocket_connect("/ws") as ws:
+            ws.close()
+            assert backend.done.wait(5)
+    assert len(set(backend.released)) == 2
+
+def test_cached_return_to_a_scene_drops_the_old_conversation(backend):
+    # A → B → A(프레임 캐시 적중) → 질문: 후속 질문이 B 장면의 대화에 이어 붙으면 안 됨
+    client = TestClient(rt_server.app)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_text(text_msg("q"))
+        ws.send_text(frame_msg(vertical=False))
+        assert result(ws)["trigger"] == "init"
+        ws.send_text(frame_msg(vertical=True))
+        assert result(ws)["trigger"] == "scene"
+        ws.send_text(frame_msg(vertical=False))
+        back = result(ws)
+        assert (back["trigger"], back["cached"]) == ("scene", True)
+        ws.send_text(text_msg("q2"))
+        follow = result(ws)
+        assert (follow["trigger"], follow["cached"]) == ("query", False)
+        ws.close()
+        assert backend.done.wait(5)
+    session = backend.released[0]
+    assert backend.log[:4] == [("q", session, True), ("q", session, True), ("release", session),
+                               ("q2", session, False)]
+
+def test_follow_up_questions_bypass_the_frame_cache(backend):
+    client = TestClient(rt_server.app)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_text(text_msg("q"))
+        ws.send_text(frame_msg(vertical=False))
+        result(ws)
+        for query in ("q2", "q", "q2"):
+            ws.send_text(text_msg(query))
+            assert result(ws)["cached"] is False
+        ws.close()
+        assert backend.done.wait(5)
+    assert [entry[0] for entry in backend.log[:4]] == ["q", "q2", "q", "q2"]
+
+def test_refresh_keeps_the_conversation(backend, monkeypatch):
+    # 안정된 장면의 주기적 재추론은 세션 없이: 대화(KV)를 버리지 않음
+    monkeypatch.setattr(rt_server.SceneGate, "from_cfg", classmethod(lambda cls, cfg: SceneGate(min_interval_ms=0)))
+    monkeypatch.setattr(rt_server, "frame_cache", None)
+    client = TestClient(rt_server.app)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_text(text_msg("q"))
+        ws.send_text(frame_msg(vertical=False))
+        assert result(ws)["trigger"] == "init"
+        ws.send_text(frame_msg(vertical=False))
+        assert result(ws)["trigger"] == "refresh"
+        ws.close()
+        assert backend.done.wait(5)
+    session = backend.released[0]
+    assert backend.log[:2] == [("q", session, True), ("q", None, True)]
@@ -0,0 +1,66 @@
+# tests/test_scene.py
+import cv2
+import numpy as np
+from app import scene as sc
+from app.scene import SceneGate
+
+def jpeg(arr: np.ndarray) -> bytes:
+    ok, buf = cv2.imencode(".jpg", arr)
+    assert ok
+    return buf.tobytes()
+
+def frame(shift: int = 0) -> bytes:
+    yy, xx = np.mgrid[0:240, 0:320]
+    return jpeg(((xx + shift) % 256).astype(np.uint8)[..., None].repeat(3, axis=-1))
+
+def test_gate_reasons(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(sc.time, "monotonic", lambda: now[0])
+    gate = SceneGate(min_interval_ms=500, max_interval_ms=2000, backoff=2.0)
+    a = frame()
+
+    assert gate.update(a, "q") == (True, "init")
+    now[0] += 0.1
+    assert gate.update(a, "q") == (False, "stable")
+    assert gate.update(a, "q2") == (True, "query")
+    now[0] += 0.1
+    assert gate.update(frame(shift=128), "q2") == (True, "scene")
+
+def test_scene_change_wins_over_a_new_question():
+    gate = SceneGate()
+    gate.update(frame(), "q")
+    assert gate.update(frame(shift=128), "q2") == (True, "scene")
+    assert gate.update(frame(shift=128), "q3") == (True, "query")
+
+def test_small_moves_add_up_to_a_scene_change(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(sc.time, "monotonic", lambda: now[0])
+    gate = SceneGate(diff_threshold=8.0, hist_threshold=0.0, min_interval_ms=500)
+    gate.update(frame(), "q")
+    now[0] += 1.0
+    assert gate.update(frame(shift=4), "q") == (True, "refresh")
+    assert gate.update(frame(shift=4), "q2") == (True, "query")
+    # 직전 추론 프레임과는 비슷하지만 대화를 시작한 장면과는 다름
+    assert gate.update(frame(shift=8), "q2") == (True, "scene")
+
+def test_stable_scene_backs_off_to_max_interval(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(sc.time, "monotonic", lambda: now[0])
+    gate = SceneGate(min_interval_ms=500, max_interval_ms=2000, backoff=2.0)
+    a = frame()
+    gate.update(a, "q")
+
+    intervals = []
+    for _ in range(4):
+        now[0] += gate.interval_ms / 1000.0
+        assert gate.update(a, "q") == (True, "refresh")
+        intervals.append(gate.interval_ms)
+    assert intervals == [1000.0, 2000.0, 2000.0, 2000.0]
+
+    # 장면이 바뀌면 간격은 다시 최소로
+    gate.update(frame(shift=128), "q")
+    assert gate.interval_ms == 500.0
+
+def test_undecodable_frame_never_fires():
+    gate = SceneGate()
+    assert gate.update(b"not an image", "q") == (False, "stable")
@@ -0,0 +1,136 @@
+# tests/test_scheduler.py
+import asyncio, threading
+import pytest
+from app.scheduler import InferenceScheduler, QueueFull, DeadlineExceeded, PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_BULK
+
+async def occupy(sched: InferenceScheduler) -> threading.Event:
+    # 워커 하나를 붙잡아 두고, 그동안 큐에 쌓인 작업을 검사
+    gate = threading.Event()
+    asyncio.ensure_future(sched.submit(gate.wait, 5))
+    while sched.stats["running"] == 0:
+        await asyncio.sleep(0.005)
+    return gate
+
+def test_full_queue_rejects_equal_priority_and_sheds_for_higher():
+    async def main():
+        sched = InferenceScheduler(max_queue=1, workers=1)
+        gate = await occupy(sched)
+        low = asyncio.ensure_future(sched.submit(lambda: "low", priority=PRIORITY_LOW))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFull):
+            await sched.submit(lambda: "low2", priority=PRIORITY_LOW)
+        high = asyncio.ensure_future(sched.submit(lambda: "high", priority=PRIORITY_HIGH))
+        await asyncio.sleep(0)
+        gate.set()
+        with pytest.raises(QueueFull):
+            await low
+        assert await high == "high"
+        assert sched.stats["shed"] == 2
+    asyncio.run(main())
+
+def test_bulk_jobs_run_after_realtime_and_are_shed_first():
+    async def main():
+        sched = InferenceScheduler(max_queue=2, workers=1)
+        gate = await occupy(sched)
+        order = []
+        bulk = [asyncio.ensure_future(sched.submit(order.append, f"bulk{i}", priority=PRIORITY_BULK)) for i in range(2)]
+        await asyncio.sleep(0)
+        live = asyncio.ensure_future(sched.submit(order.append, "live", priority=PRIORITY_LOW))
+        await asyncio.sleep(0)
+        gate.set()
+        await live
+        await bulk[0]
+        with pytest.raises(QueueFull):
+            await bulk[1]
+        assert order == ["live", "bulk0"]
+    asyncio.run(main())
+
+def test_expired_job_is_never_run():
+    async def main():
+        sched = InferenceScheduler(workers=1)
+        gate = await occupy(sched)
+        ran = []
+        job = asyncio.ensure_future(sched.submit(ran.append, 1, deadline_ms=10))
+        await asyncio.sleep(0.05)
+        gate.set()
+        with pytest.raises(DeadlineExceeded):
+            await job
+        assert ran == []
+        assert sched.stats["expired"] == 1
+    asyncio.run(main())
+
+def test_expired_jobs_do_not_count_against_the_queue():
+    async def main():
+        sched = InferenceScheduler(max_queue=1, workers=1)
+        gate = await occupy(sched)
+        old = asyncio.ensure_future(sched.submit(lambda: "old", deadline_ms=10))
+        await asyncio.sleep(0.05)
+        new = asyncio.ensure_future(sched.submit(lambda: "new"))
+        await asyncio.sleep(0)
+        gate.set()
+        with pytest.raises(DeadlineExceeded):
+            await old
+        assert await new == "new"
+        assert sched.stats["shed"] == 0
+    asyncio.run(main())
+
+def test_batches_group_by_fn_and_batch_key():
+    calls = []
+
+    def f(items, **kwargs):
+        calls.append(("f", sorted(items)))
+        return [i.upper() for i in items]
+
+    def g(items, **kwargs):
+        calls.append(("g", sorted(items)))
+        return [i * 2 for i in items]
+
+    async def main():
+        sched = InferenceScheduler(workers=1, max_batch=4, max_wait_ms=20)
+        gate = await occupy(sched)
+        jobs = [
+            asyncio.ensure_future(sched.submit_batched(f, "a1", batch_key="a")),
+            asyncio.ensure_future(sched.submit_batched(f, "b1", batch_key="b")),
+            asyncio.ensure_future(sched.submit_batched(f, "a2", batch_key="a")),
+            asyncio.ensure_future(sched.submit_batched(g, "a3", batch_key="a")),
+        ]
+        await asyncio.sleep(0)
+        gate.set()
+        return await asyncio.gather(*jobs)
+
+    assert asyncio.run(main()) == ["A1", "B1", "A2", "a3a3"]
+    assert sorted(calls) == [("f", ["a1", "a2"]), ("f", ["b1"]), ("g", ["a3"])]
+
+def test_batch_is_capped_at_max_batch():
+    sizes = []
+
+    def f(items):
+        sizes.append(len(items))
+        return items
+
+    async def main():
+        sched = InferenceScheduler(workers=1, max_batch=2, max_wait_ms=20)
+        gate = await occupy(sched)
+        jobs = [asyncio.ensure_future(sched.submit_batched(f, i)) for i in range(5)]
+        await asyncio.sleep(0)
+        gate.set()
+        assert await asyncio.gather(*jobs) == list(range(5))
+
+    asyncio.run(main())
+    assert sizes == [2, 2, 1]
+
+def test_batch_failure_fails_every_job_in_it():
+    def boom(items):
+        raise RuntimeError("oom")
+
+    async def main():
+        sched = InferenceScheduler(workers=1, max_batch=4, max_wait_ms=20)
+        gate = await occupy(sched)
+        jobs = [asyncio.ensure_future(sched.submit_batched(boom, i)) for i in range(3)]
+        await asyncio.sleep(0)
+        gate.set()
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert sched.stats["failed"] == 3
+
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+# tests/test_session_store.py
+from app.pipeline import SessionState, SessionStore
+
+def state(nbytes: int, turn: int = 1) -> SessionState:
+    return SessionState(kv=None, mask=None, ids=None, tail=None, tail_pos=0, turn=turn, bytes=nbytes)
+
+def test_turn_takes_and_puts_back():
+    store = SessionStore(max_session_bytes=100, max_total_bytes=1000)
+    assert store.take("s") is None
+    store.put("s", state(10))
+    assert len(store) == 1 and store.bytes == 10
+    st = store.take("s")
+    assert st.turn == 1 and len(store) == 0 and store.bytes == 0
+    store.put("s", state(20, turn=2))
+    assert store.stats() == {"sessions": 1, "bytes": 20, "evictions": 0}
+
+def test_release_during_a_turn_is_not_undone_by_its_put():
+    store = SessionStore(max_session_bytes=100, max_total_bytes=1000)
+    store.take("s")
+    store.drop("s")
+    store.put("s", state(10))
+    assert len(store) == 0 and store.bytes == 0
+    # 표시는 그 턴에서만 유효
+    store.take("s")
+    store.put("s", state(10))
+    assert len(store) == 1
+
+def test_release_between_turns_drops_the_state():
+    store = SessionStore(max_session_bytes=100, max_total_bytes=1000)
+    store.take("s")
+    store.put("s", state(10))
+    store.drop("s")
+    assert len(store) == 0 and store.bytes == 0
+
+def test_failed_turn_leaves_nothing_behind():
+    store = SessionStore(max_session_bytes=100, max_total_bytes=1000)
+    store.take("s")
+    store.put("s", None)
+    assert len(store) == 0
+    store.drop("s")
+    store.take("s")
+    store.put("s", state(10))
+    assert len(store) == 1
+
+def test_budgets():
+    store = SessionStore(max_session_bytes=50, max_total_bytes=100)
+    store.take("big")
+    store.put("big", state(60))
+    assert len(store) == 0
+    for name in ("a", "b", "c"):
+        store.take(name)
+        store.put(name, state(40))
+    assert store.stats() == {"sessions": 2, "bytes": 80, "evictions": 1}
+    assert store.take("a") is None
+    assert store.take("c") is not None
@@ -0,0 +1,83 @@
+# tests/test_stop.py
+import torch
+from app.pipeline import SENTENCE_END, StopCfg, StopPolicies, answer_span, classify_query
+
+EOS = 0
+
+class PieceTokenizer:
+    # 토큰 id = 조각 목록의 인덱스 (0은 eos)
+    def __init__(self):
+        self.pieces = ["<|im_end|>"]
+
+    def encode(self, pieces):
+        ids = []
+        for p in pieces:
+            if p not in self.pieces:
+                self.pieces.append(p)
+            ids.append(self.pieces.index(p))
+        return ids
+
+    def decode(self, ids, skip_special_tokens=False):
+        return "".join(self.pieces[int(i)] for i in ids if not (skip_special_tokens and int(i) == EOS))
+
+def run(pieces, query="이게 뭐야?", cfg=None, max_new_tokens=64):
+    # 디코드 루프처럼 토큰을 하나씩 붙이며 종료 조건을 확인, (멈춘 시점까지의 토큰 수, 이유, 정리된 답) 반환
+    tok = PieceTokenizer()
+    ids = tok.encode(pieces)
+    stop = StopPolicies(tok, torch.tensor([EOS]), [classify_query(query)], cfg or StopCfg(), max_new_tokens)
+    n = 0
+    for n in range(1, len(ids) + 1):
+        if bool(stop(torch.tensor([ids[:n]]), None)[0]):
+            break
+    text = tok.decode(ids[:n], skip_special_tokens=True)
+    return n, stop.reason(0), stop.trim(0, text).strip()
+
+def test_answer_span_skips_leading_prefixes():
+    assert answer_span("컵입니다.") == (0, None)
+    assert answer_span("A: 컵입니다.") == (3, None)
+    assert answer_span("assistant\nA: 컵") == (13, None)
+    # 답변 텍스트 없이 접두어만 이어지면 따라 쓰기로 보지 않음
+    assert answer_span("A: \nQ:") == (6, None)
+
+def test_answer_span_finds_echoed_role_after_the_answer():
+    assert answer_span("컵입니다.\nUser: 다음") == (0, 5)
+    assert answer_span("A: 컵\nQ: 또") == (3, 4)
+    assert answer_span("<|im_start|>assistant\n컵<|im_end|>") == (22, 23)
+
+def test_leading_answer_prefix_is_stripped_not_a_stop():
+    assert run(["A", ":", " \"", "컵", "입니다", ".\"", " ", "Q", ":"]) == (7, "sentence", "\"컵입니다.\"")
+    assert run(["assistant", "\n", "컵", "입니다", ".", " "]) == (6, "sentence", "컵입니다.")
+
+def test_echoed_role_turn_after_the_answer_stops():
+    n, reason, text = run(["컵", "입니다", "\n", "User", ":", " 다음"])
+    assert (n, reason, text) == (5, "role_marker", "컵입니다")
+    assert run(["컵", "<|im_start|>", "user"])[1:] == ("role_marker", "컵")
+
+def test_bare_role_prefix_does_not_stop_early():
+    assert run(["A", ":", " "], max_new_tokens=3) == (3, "budget", "")
+    assert run(["A", ":", " 컵"], max_new_tokens=3)[2] == "컵"
+
+def test_sentence_end_needs_whitespace():
+    assert SENTENCE_END.findall("8.5인치 화면") == []
+    assert SENTENCE_END.findall("Gen 2.0 칩입니다") == []
+    assert len(SENTENCE_END.findall("스마트폰입니다. 그리고")) == 1
+    assert len(SENTENCE_END.findall("\"정말요?\" 네")) == 1
+
+def test_exact_model_queries_get_more_sentences():
+    pieces = ["갤럭시", "입니다", ".", " ", "2023년", " 출시", ".", " ", "8 GB", ".", " ", "끝", ".", " "]
+    assert run(pieces, "이게 뭐야?")[1:] == ("sentence", "갤럭시입니다.")
+    n, reason, text = run(pieces, "정확한 모델명이 뭐야?")
+    assert (reason, text) == ("sentence", "갤럭시입니다. 2023년 출시. 8 GB.")
+    assert n == 11
+
+def test_eos_budget_and_fallback_reasons():
+    assert run(["컵", "<|im_end|>"])[:2] == (2, "eos")
+    assert run(["컵"] * 10, max_new_tokens=4)[:2] == (4, "budget")
+    cfg = StopCfg(budgets={"default": (100, 1)})
+    assert run(["컵"] * 3, cfg=cfg)[1] == "max_new_tokens"
+
+def test_policies_can_be_disabled():
+    cfg = StopCfg(sentence=False, role_markers=False)
+    n, reason, text = run(["컵", "입니다", ".", " ", "\n", "User", ":"], cfg=cfg, max_new_tokens=7)
+    assert reason == "budget"
+    assert text == "컵입니다. \nUser:"
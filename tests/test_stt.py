@@ -0,0 +1,80 @@
+# tests/test_stt.py
+import asyncio, io, wave
+import numpy as np
+from app.stt import SAMPLE_RATE, SpeechToText, VadSegmenter, resample_pcm16, wav_to_pcm16k
+
+def tone(seconds: float) -> bytes:
+    # 배음이 있는 200Hz 톤 (webrtcvad가 음성으로 판정)
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    x = sum(np.sin(2 * np.pi * 200 * k * t) / k for k in range(1, 8)) * 6000
+    return x.astype(np.int16).tobytes()
+
+def silence(seconds: float) -> bytes:
+    return bytes(int(SAMPLE_RATE * seconds) * 2)
+
+def feed_chunks(vad: VadSegmenter, pcm: bytes, size: int = 1000):
+    # 클라이언트 조각 크기는 VAD 프레임과 맞지 않음
+    out = []
+    for i in range(0, len(pcm), size):
+        out += vad.feed(pcm[i:i + size])
+    return out
+
+def test_utterance_ends_after_trailing_silence():
+    vad = VadSegmenter(end_silence_ms=300, min_speech_ms=100)
+    assert feed_chunks(vad, silence(0.5)) == []
+    assert feed_chunks(vad, tone(0.6)) == []
+    assert vad.in_speech
+    utts = feed_chunks(vad, silence(1.0))
+    assert len(utts) == 1 and not vad.in_speech
+    seconds = len(utts[0]) / 2 / SAMPLE_RATE
+    assert 0.6 <= seconds <= 1.3
+
+def test_short_blip_is_dropped():
+    vad = VadSegmenter(end_silence_ms=300, min_speech_ms=1000)
+    assert feed_chunks(vad, silence(0.3) + tone(0.2) + silence(1.0)) == []
+
+def test_flush_closes_an_open_utterance():
+    vad = VadSegmenter(min_speech_ms=100)
+    assert vad.flush() is None
+    feed_chunks(vad, tone(0.6))
+    utt = vad.flush()
+    assert utt is not None and len(utt) >= len(tone(0.4))
+    assert not vad.in_speech
+
+def test_long_speech_is_split_at_max_utterance():
+    vad = VadSegmenter(max_utterance_s=1.0)
+    utts = feed_chunks(vad, tone(2.5))
+    assert len(utts) == 2
+    # 상한은 프레임 단위로 확인하므로 한 프레임까지 넘을 수 있음
+    assert all(len(u) <= SAMPLE_RATE * 2 + vad.frame_bytes for u in utts)
+
+def test_resample_and_wav_conversion():
+    assert len(resample_pcm16(bytes(48000 * 2), 48000)) == SAMPLE_RATE * 2
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(8000)
+        w.writeframes(np.zeros((8000, 2), dtype=np.int16).tobytes())
+    assert len(wav_to_pcm16k(buf.getvalue())) == SAMPLE_RATE * 2
+
+class BrokenEngine:
+    def __init__(self, **kwargs):
+        raise RuntimeError("model download failed")
+
+def test_engine_failure_disables_voice_instead_of_raising():
+    stt = SpeechToText({"engine": "tests.test_stt:BrokenEngine"})
+    assert stt.state == "idle"
+    stt.load()
+    assert stt.state == "failed" and not stt.ready
+    assert "model download failed" in stt.error
+
+def test_null_engine_loads_in_the_background():
+    async def main():
+        stt = SpeechToText({"engine": "none"})
+        await stt.start()
+        while stt.state == "loading":
+            await asyncio.sleep(0.01)
+        assert stt.ready
+        assert await stt.transcribe(tone(0.5)) == ""
+    asyncio.run(main())